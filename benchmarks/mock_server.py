@@ -0,0 +1,269 @@
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+USER_ID = "bench-user"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+
+
+class MockChatServer:
+    """Local stand-in for the chat server, serving every endpoint used in src/.
+
+    Each room is shared by the benchmark user and one friend. ``latency``
+    seconds are added to every request, ``etag`` enables conditional GETs,
+    ``stream`` the Server-Sent Events endpoint and ``compress`` gzip and, when
+    msgpack is installed, MessagePack bodies for clients asking for them.
+    """
+
+    def __init__(
+        self,
+        friends: int = 2,
+        history: int = 0,
+        latency: float = 0.0,
+        etag: bool = True,
+        stream: bool = True,
+        compress: bool = True,
+    ):
+        self.latency = latency
+        self.etag = etag
+        self.stream = stream
+        self.compress = compress
+        self.requests = 0
+        self.friends = [
+            {"id": f"friend{i}", "name": f"Friend {i}", "chatroom_id": f"room{i}"}
+            for i in range(friends)
+        ]
+        self.messages: Dict[str, List[Dict]] = {
+            friend["chatroom_id"]: [] for friend in self.friends
+        }
+        self._changed = threading.Condition()
+        self._server = None
+        self._generator = None
+        self._stopped = threading.Event()
+
+        for friend in self.friends[:1]:
+            for i in range(history):
+                self.add_message(friend["chatroom_id"], friend["id"], f"history {i}")
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockChatServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._changed:
+            self._changed.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def add_message(self, chatroom_id: str, sender_id: str, content: str) -> Dict:
+        message = {
+            "id": uuid.uuid4().hex,
+            "chatroom_id": chatroom_id,
+            "sender_id": sender_id,
+            "content": content,
+            "sent_at": _now(),
+        }
+        with self._changed:
+            self.messages.setdefault(chatroom_id, []).append(message)
+            self._changed.notify_all()
+        return message
+
+    def generate(self, rate: float, chatroom_ids: Optional[List[str]] = None):
+        """Have friends post ``rate`` messages per second until stopped."""
+        self.stop_generating()
+        if rate <= 0:
+            return
+
+        rooms = chatroom_ids or list(self.messages)
+        stop = threading.Event()
+
+        def run():
+            count = 0
+            while not stop.wait(random.expovariate(rate)):
+                room = random.choice(rooms)
+                sender = next(f["id"] for f in self.friends if f["chatroom_id"] == room)
+                self.add_message(room, sender, f"generated {count}")
+                count += 1
+
+        self._generator = stop
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop_generating(self):
+        if self._generator is not None:
+            self._generator.set()
+            self._generator = None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server._delay()
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                parts = url.path.strip("/").split("/")
+
+                if url.path == "/auth/login":
+                    return self._json({"client_id": "bench", "auth_url": None})
+                if parts[:2] == ["auth", "token"]:
+                    return self._json(
+                        {"user_id": USER_ID, "session_token": "bench-token"}
+                    )
+                if url.path == "/friends/":
+                    return self._json(server.friends)
+                if url.path == "/friends/requests":
+                    return self._json([])
+                if url.path == "/chat/chatrooms":
+                    return self._json({"chatrooms": server._chatrooms()})
+                if parts[:2] == ["chat", "chatrooms"] and len(parts) == 4:
+                    if parts[3] == "messages":
+                        return self._json({"messages": server._page(parts[2], **query)})
+                    if parts[3] == "stream" and server.stream:
+                        return self._stream(parts[2])
+                self._json({"detail": "Not Found"}, 404)
+
+            def do_POST(self):
+                server._delay()
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+                if url.path == "/chat/messages":
+                    server.add_message(
+                        body["chatroom_id"], body["sender_id"], body["content"]
+                    )
+                    return self._json({"status": "ok"})
+                if url.path == "/auth/refresh":
+                    return self._json(
+                        {"user_id": USER_ID, "session_token": "bench-token"}
+                    )
+                if url.path.startswith("/friends/"):
+                    return self._json({"status": "ok"})
+                self._json({"detail": "Not Found"}, 404)
+
+            def _json(self, data, status: int = 200):
+                content_type = "application/json"
+                accept = self.headers.get("Accept", "")
+                if server.compress and msgpack and "application/msgpack" in accept:
+                    content_type = "application/msgpack"
+                    body = msgpack.packb(data)
+                else:
+                    body = json.dumps(data).encode()
+
+                if server.etag and status == 200:
+                    tag = f'"{hashlib.md5(body).hexdigest()}"'
+                    if self.headers.get("If-None-Match") == tag:
+                        self.send_response(304)
+                        self.send_header("ETag", tag)
+                        self.end_headers()
+                        return
+                    self.send_response(status)
+                    self.send_header("ETag", tag)
+                else:
+                    self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Vary", "Accept, Accept-Encoding")
+                if server.compress and "gzip" in self.headers.get(
+                    "Accept-Encoding", ""
+                ):
+                    body = gzip.compress(body, compresslevel=5)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, chatroom_id: str):
+                # Counted before replying, messages added once the client has
+                # the response are all sent
+                with server._changed:
+                    seen = len(server.messages.get(chatroom_id, []))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(event: bytes):
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                    self.wfile.flush()
+
+                try:
+                    send(b": connected\n\n")
+                    while not server._stopped.is_set():
+                        with server._changed:
+                            # Messages added while sending are not waited for
+                            server._changed.wait_for(
+                                lambda: server._stopped.is_set()
+                                or len(server.messages.get(chatroom_id, [])) > seen,
+                                5,
+                            )
+                            new = server.messages.get(chatroom_id, [])[seen:]
+                        seen += len(new)
+                        for message in new:
+                            send(b"data: " + json.dumps(message).encode() + b"\n\n")
+                        if not new:
+                            send(b": ping\n\n")
+                except OSError:
+                    pass
+
+        return Handler
+
+    def _delay(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _chatrooms(self) -> List[Dict]:
+        with self._changed:
+            return [
+                {
+                    "id": chatroom_id,
+                    "last_message_at": messages[-1]["sent_at"] if messages else None,
+                }
+                for chatroom_id, messages in self.messages.items()
+            ]
+
+    def _page(
+        self,
+        chatroom_id: str,
+        limit: str = "50",
+        skip: str = "0",
+        since: str = None,
+        **kwargs,
+    ) -> List[Dict]:
+        # Newest first, like the real server
+        with self._changed:
+            messages = self.messages.get(chatroom_id, [])
+            if since:
+                messages = [msg for msg in messages if msg["sent_at"] >= since]
+            newest_first = messages[::-1]
+        return newest_first[int(skip) : int(skip) + int(limit)]
@@ -0,0 +1,180 @@
+"""Drive ChatApp headlessly against the mock chat server and report timings.
+
+    python -m benchmarks.run --friends 1000 --history 5000 --rate 20
+
+Results are printed as JSON, and also written to ``--output`` when given, so
+runs can be compared across releases.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from .mock_server import USER_ID, MockChatServer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--friends", type=int, default=50)
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--rate", type=float, default=10, help="messages per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--sends", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--no-stream", dest="stream", action="store_false")
+    parser.add_argument("--no-etag", dest="etag", action="store_false")
+    parser.add_argument("--no-compress", dest="compress", action="store_false")
+    parser.add_argument("--output")
+    return parser.parse_args()
+
+
+def summarize(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+async def wait_for(pilot, condition, timeout: float = 30) -> float:
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("benchmark condition not met")
+        await pilot.pause(0.001)
+    return time.perf_counter() - start
+
+
+async def run(args) -> dict:
+    # Imported late, config is read from the temporary home set up in main()
+    from src.app import ChatApp
+    from src.config import config
+    from src.metrics import metrics
+    from src.widgets import MessageView, list_item_id
+
+    server = MockChatServer(
+        friends=args.friends,
+        history=args.history,
+        latency=args.latency,
+        etag=args.etag,
+        stream=args.stream,
+        compress=args.compress,
+    ).start()
+    config.settings.server_url = server.url
+    config.settings.use_message_stream = args.stream
+    config.save_auth({"user_id": USER_ID, "session_token": "bench-token"})
+
+    results = {"args": vars(args)}
+    app = ChatApp()
+    start = time.perf_counter()
+    async with app.run_test(size=(120, 40)) as pilot:
+        friend_list = app.query_one("#listview-friend")
+        message_view = app.query_one(MessageView)
+
+        # Startup: until every friend is listed
+        await wait_for(pilot, lambda: len(friend_list.children) == args.friends)
+        results["startup"] = time.perf_counter() - start
+
+        # Opening the room with the long history
+        room = server.friends[0]
+        ids = [item.id for item in friend_list.children]
+        friend_list.index = ids.index(list_item_id("friend", room["id"]))
+        friend_list.action_select_cursor()
+        results["open_room"] = await wait_for(
+            pilot, lambda: len(message_view.messages) > 0 or not args.history
+        )
+
+        # Send to display: local echo, then the server copy replacing it
+        echoes, deliveries = [], []
+        for i in range(args.sends):
+            content = f"bench {i}"
+            app.query_one("#input-message").value = content
+            sent = time.perf_counter()
+            await pilot.press("enter")
+            await wait_for(
+                pilot,
+                lambda: any(m["content"] == content for m in message_view.messages),
+            )
+            echoes.append(time.perf_counter() - sent)
+            await wait_for(
+                pilot,
+                lambda: any(
+                    m["content"] == content and not m["id"].startswith("local-")
+                    for m in message_view.messages
+                ),
+            )
+            deliveries.append(time.perf_counter() - sent)
+        results["send_echo"] = summarize(echoes)
+        results["send_delivery"] = summarize(deliveries)
+
+        # Scrolling back through history, one page per load
+        pages = []
+        for _ in range(args.pages):
+            if app.history_complete:
+                break
+            count = len(message_view.messages)
+            message_view.scroll_home(animate=False, immediate=True)
+            pages.append(
+                await wait_for(
+                    pilot,
+                    lambda: len(message_view.messages) != count or app.history_complete,
+                )
+            )
+        results["history_page"] = summarize(pages)
+        message_view.scroll_end(animate=False, immediate=True)
+
+        # Refresh cost with friends posting into the open room
+        server.generate(args.rate, [room["chatroom_id"]])
+        cpu, wall = time.process_time(), time.perf_counter()
+        await pilot.pause(args.duration)
+        results["refresh_cpu"] = (time.process_time() - cpu) / (
+            time.perf_counter() - wall
+        )
+
+        # Memory over time under the same load, traced separately as it slows
+        # everything down
+        tracemalloc.start()
+        memory = []
+        for _ in range(int(args.duration)):
+            await pilot.pause(1)
+            memory.append(tracemalloc.get_traced_memory()[0])
+        results["memory"] = {
+            "samples": memory,
+            "peak": tracemalloc.get_traced_memory()[1],
+        }
+        tracemalloc.stop()
+        server.stop_generating()
+
+        results["rendered_messages"] = len(message_view.messages)
+        results["server_requests"] = server.requests
+        results["metrics"] = metrics.snapshot()
+
+    server.stop()
+    return results
+
+
+def main():
+    args = parse_args()
+    os.environ["HOME"] = tempfile.mkdtemp(prefix="chat-terminal-bench-")
+    results = asyncio.run(run(args))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
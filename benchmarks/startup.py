@@ -0,0 +1,106 @@
+"""Measure cold start in fresh interpreters and check it against targets.
+
+    python -m benchmarks.startup --runs 5 --latency 2
+
+``cli`` is ``chat-terminal --help``, ``first_frame`` the time from spawning
+the UI until its first frame is on screen, with every request to the mock
+server taking ``--latency`` seconds, so friends can only arrive later.
+Exits with status 1 when a median is over its target.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .mock_server import USER_ID, MockChatServer
+
+ROOT = Path(__file__).resolve().parent.parent
+
+FIRST_FRAME = """
+import asyncio
+from pathlib import Path
+
+import src.app
+from src.app import ChatApp
+
+class App(ChatApp):
+    CSS_PATH = Path(src.app.__file__).parent / ChatApp.CSS_PATH
+
+    def on_ready(self):
+        super().on_ready()
+        print("ready", flush=True)
+        self.exit()
+
+asyncio.run(App().run_async(headless=True))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=2)
+    parser.add_argument("--cli-target", type=float, default=0.15)
+    parser.add_argument("--first-frame-target", type=float, default=1.0)
+    return parser.parse_args()
+
+
+def timed(command: list, env: dict, marker: str = None) -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True
+    )
+    for line in process.stdout:
+        if marker and line.strip() == marker:
+            elapsed = time.perf_counter() - start
+            break
+    else:
+        elapsed = time.perf_counter() - start
+        if marker:
+            raise RuntimeError(f"{command} exited without printing {marker!r}")
+    process.communicate()
+    return elapsed
+
+
+def main():
+    args = parse_args()
+    server = MockChatServer(friends=50, latency=args.latency).start()
+
+    home = tempfile.mkdtemp(prefix="chat-terminal-startup-")
+    config_dir = os.path.join(home, ".config", "chat-terminal")
+    os.makedirs(config_dir)
+    with open(os.path.join(config_dir, "settings.toml"), "w") as f:
+        f.write(f'server_url = "{server.url}"\n')
+    with open(os.path.join(config_dir, "auth.json"), "w") as f:
+        json.dump({"user_id": USER_ID, "session_token": "bench-token"}, f)
+    env = dict(os.environ, HOME=home)
+
+    cli = [sys.executable, "-c", "from src.cli import main; main()", "--help"]
+    ui = [sys.executable, "-c", FIRST_FRAME]
+    results = {
+        "cli": [timed(cli, env) for _ in range(args.runs)],
+        "first_frame": [timed(ui, env, "ready") for _ in range(args.runs)],
+    }
+    server.stop()
+
+    targets = {"cli": args.cli_target, "first_frame": args.first_frame_target}
+    report = {
+        name: {
+            "median": statistics.median(samples),
+            "target": targets[name],
+            "samples": samples,
+        }
+        for name, samples in results.items()
+    }
+    print(json.dumps(report, indent=2))
+    if any(result["median"] > result["target"] for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
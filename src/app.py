@@ -1,15 +1,28 @@
+import asyncio
 import os
-import threading
 import time
 
-from textual import events, log
+import requests
+from rich.text import Text
+from textual import events, log, work
 from textual.app import App, ComposeResult
 from textual.containers import Container, Grid, Horizontal, Vertical
 from textual.screen import ModalScreen
-from textual.widgets import Button, Input, Label, ListItem, ListView, RichLog
-
-from .auth import get_auth, login_flow
-from .chat import fetch_chatrooms, fetch_messages, format_message, send_message
+from textual.widgets import Button, Input, Label, ListItem, ListView
+
+from .auth import LoginFlow, get_auth
+from .chat import (
+    MessageStream,
+    MessageSync,
+    RoomWatcher,
+    StreamUnsupported,
+    fetch_chatrooms,
+    fetch_messages,
+    message_key,
+    post_message,
+    utc_timestamp,
+)
+from .client import client, is_undelivered
 from .config import config
 from .friends import (
     accept_friend_request,
@@ -19,6 +32,14 @@ from .friends import (
     reject_friend_request,
     send_friend_request,
 )
+from .metrics import metrics
+from .outbox import outbox
+from .scheduler import PollScheduler
+from .store import store
+from .widgets import MessageView, MetricsPanel, list_item_id, reconcile_list_view
+
+# Message updates arriving within one frame are applied together
+UPDATE_INTERVAL = 1 / 60
 
 
 class FriendModal(ModalScreen):
@@ -26,6 +47,10 @@ class FriendModal(ModalScreen):
         super().__init__()
         self.user_id = None
         self.friends = []
+        self.friend_requests = []
+        # Friend or friend request shown by each list item
+        self.items = {}
+        self.listview_lock = asyncio.Lock()
 
     def compose(self) -> ComposeResult:
         yield Container(
@@ -36,7 +61,7 @@ class FriendModal(ModalScreen):
         )
 
     def on_mount(self) -> None:
-        self._update_listview()
+        self.run_worker(self._update_listview(), exclusive=True, group="listview")
 
     def on_key(self, event: events.Key) -> None:
         if event.key == "enter":
@@ -47,53 +72,66 @@ class FriendModal(ModalScreen):
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "button-close-modal":
-            self.app.pop_screen()
+            self.dismiss()
         elif event.button.id == "button-del-friend":
-            list_item_id = event.button.parent.parent.id
-            friend_id = self.friends[int(list_item_id.split("-")[-1])]["id"]
+            friend_id = self.items[event.button.parent.parent.id]["id"]
             self._del_friend(friend_id)
         elif event.button.id == "button-accept-friend-request":
-            list_item_id = event.button.parent.parent.id
-            friend_id = self.friend_requests[int(list_item_id.split("-")[-1])]["id"]
+            friend_id = self.items[event.button.parent.parent.id]["id"]
             self._accept_friend_request(friend_id)
         elif event.button.id == "button-reject-friend-request":
-            list_item_id = event.button.parent.parent.id
-            friend_id = self.friend_requests[int(list_item_id.split("-")[-1])]["id"]
+            friend_id = self.items[event.button.parent.parent.id]["id"]
             self._reject_friend_request(friend_id)
 
-    def _update_listview(self) -> None:
-        self.query_one("#listview-friend-modal").clear()
-        timestamp = int(time.time())
-
-        self.friend_requests = fetch_friend_requests(self.user_id)
-        for i, friend_request in enumerate(self.friend_requests):
-            self.query_one("#listview-friend-modal").append(
-                ListItem(
-                    Grid(
-                        Label(friend_request["name"], id="label-friend-name"),
-                        Button("Accept", id=f"button-accept-friend-request"),
-                        Button("Reject", id=f"button-reject-friend-request"),
-                        id="grid-friend-request-item",
-                    ),
-                    id=f"modal-friend-request-{timestamp}-{i}",
-                )
-            )
+    async def _update_listview(self) -> None:
+        # One refresh at a time, so results are applied in the order fetched
+        async with self.listview_lock:
+            await self._refresh_listview()
 
-        self.friends = fetch_friends(self.user_id)
-        for i, friend in enumerate(self.friends):
-            self.query_one("#listview-friend-modal").append(
-                ListItem(
-                    Grid(
-                        Label(friend["name"], id="label-friend-name"),
-                        Button("Delete", id=f"button-del-friend"),
-                        id="grid-friend-item",
-                    ),
-                    id=f"modal-friend-{timestamp}-{i}",
-                )
+    async def _refresh_listview(self) -> None:
+        self.friend_requests, self.friends = await asyncio.gather(
+            client.call(fetch_friend_requests, self.user_id),
+            client.call(fetch_friends, self.user_id),
+        )
+
+        items = {}
+        for friend_request in self.friend_requests:
+            items[list_item_id("modal-request", friend_request["id"])] = friend_request
+        for friend in self.friends:
+            items[list_item_id("modal-friend", friend["id"])] = friend
+        self.items = items
+
+        await reconcile_list_view(
+            self.query_one("#listview-friend-modal"),
+            items,
+            self._create_item,
+            lambda item, friend: item.query_one(Label).update(friend["name"]),
+        )
+
+    def _create_item(self, item_id: str, friend: dict) -> ListItem:
+        if item_id.startswith("modal-request-"):
+            return ListItem(
+                Grid(
+                    Label(friend["name"], id="label-friend-name"),
+                    Button("Accept", id=f"button-accept-friend-request"),
+                    Button("Reject", id=f"button-reject-friend-request"),
+                    id="grid-friend-request-item",
+                ),
+                id=item_id,
             )
 
-    def _add_friend(self, email: str) -> None:
-        response = send_friend_request(email)
+        return ListItem(
+            Grid(
+                Label(friend["name"], id="label-friend-name"),
+                Button("Delete", id=f"button-del-friend"),
+                id="grid-friend-item",
+            ),
+            id=item_id,
+        )
+
+    @work(group="friend-action")
+    async def _add_friend(self, email: str) -> None:
+        response = await client.call(send_friend_request, email)
         if not response:
             self.notify("Error sending friend request")
             return
@@ -103,8 +141,9 @@ class FriendModal(ModalScreen):
         else:
             self.notify(response.json().get("detail"))
 
-    def _del_friend(self, friend_id: str) -> None:
-        response = delete_friend(friend_id)
+    @work(group="friend-action")
+    async def _del_friend(self, friend_id: str) -> None:
+        response = await client.call(delete_friend, friend_id)
         if not response:
             self.notify("Failed to delete friend")
             return
@@ -114,10 +153,11 @@ class FriendModal(ModalScreen):
         else:
             self.notify(response.json().get("detail"))
 
-        self._update_listview()
+        await self._update_listview()
 
-    def _accept_friend_request(self, friend_id: str) -> None:
-        response = accept_friend_request(friend_id)
+    @work(group="friend-action")
+    async def _accept_friend_request(self, friend_id: str) -> None:
+        response = await client.call(accept_friend_request, friend_id)
         if not response:
             self.notify("Failed to accept friend request")
             return
@@ -127,10 +167,11 @@ class FriendModal(ModalScreen):
         else:
             self.notify(response.json().get("detail"))
 
-        self._update_listview()
+        await self._update_listview()
 
-    def _reject_friend_request(self, friend_id: str) -> None:
-        response = reject_friend_request(friend_id)
+    @work(group="friend-action")
+    async def _reject_friend_request(self, friend_id: str) -> None:
+        response = await client.call(reject_friend_request, friend_id)
         if not response:
             self.notify("Failed to reject friend request")
             return
@@ -140,20 +181,92 @@ class FriendModal(ModalScreen):
         else:
             self.notify(response.json().get("detail"))
 
-        self._update_listview()
+        await self._update_listview()
 
 
-class ChatApp(App):
-    CSS_PATH = "app.css"
+class LoginModal(ModalScreen):
+    """Shows how a login is going, until it ends or is cancelled."""
 
-    def __init__(self):
+    def __init__(self, flow: LoginFlow):
         super().__init__()
+        self.flow = flow
+
+    def compose(self) -> ComposeResult:
+        yield Container(
+            Label("Starting login", id="label-login-status"),
+            Button("Cancel", id="button-cancel-login"),
+            id="container-login-modal",
+        )
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        if event.button.id == "button-cancel-login":
+            event.stop()
+            self.flow.cancel()
+            self.query_one("#label-login-status", Label).update("Cancelling")
+
+    def show_progress(self, message: str):
+        if self.is_attached:
+            self.query_one("#label-login-status", Label).update(Text(message))
+
+
+class Session:
+    """One profile's login and chat state, kept while other profiles are shown.
+
+    Cached friends, room activity and sync positions make switching back
+    to a profile render at once and fetch only what is new.
+    """
+
+    def __init__(self, profile: str, user_id: str = None):
+        self.profile = profile
+        self.user_id = user_id
         self.chatroom_id = None
-        self.user_id = None
         self.chatrooms = []
         self.friends = []
-        self.should_update = False
-        self.update_thread = None
+        self.message_sync = MessageSync(store)
+        self.room_watcher = RoomWatcher()
+        # Local copies of queued messages, shown until the server copy arrives
+        self.echoes = []
+
+    def unread(self) -> int:
+        return sum(self.room_watcher.unread.values())
+
+
+class ChatApp(App):
+    CSS_PATH = "app.css"
+    BINDINGS = [
+        ("f2", "toggle_metrics", "Metrics"),
+        ("f3", "next_profile", "Next profile"),
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self.created = time.perf_counter()
+        # Every profile with a login, all polled by the same schedulers over
+        # the shared connection pool, and the one shown
+        self.sessions = {}
+        self.session = Session(config.profile)
+        self.stream_supported = config.settings.use_message_stream
+        self.poll_scheduler = PollScheduler()
+        self.room_scheduler = PollScheduler(
+            config.settings.room_watch_interval,
+            config.settings.room_watch_interval,
+            name="rooms",
+        )
+        self.send_scheduler = PollScheduler(
+            config.settings.poll_min_interval, name="send"
+        )
+        self.outbox_ready = asyncio.Event()
+        # Reconciling the friend list is not safe to interleave
+        self.friends_lock = asyncio.Lock()
+        self.syncs = {}
+        self.pending_updates = []
+        self.update_timer = None
+        self.search_results = {}
+
+        # How many server messages are newer than the oldest one rendered
+        self.history_skip = 0
+        self.history_complete = False
+        self.detached = False
 
     def compose(self) -> ComposeResult:
         yield Horizontal(
@@ -161,10 +274,13 @@ class ChatApp(App):
                 ListView(id="listview-friend"),
                 Button(label="Friends", id="button-friends"),
                 Button(label="Login", id="button-login"),
+                Button(label=config.profile, id="button-profile"),
                 id="sidebar",
             ),
             Vertical(
-                RichLog(wrap=True, markup=True, id="richlog-message"),
+                Input(type="text", placeholder="Search", id="input-search"),
+                ListView(id="listview-search"),
+                MessageView(id="message-view"),
                 Input(
                     type="text",
                     placeholder="Aa",
@@ -172,125 +288,702 @@ class ChatApp(App):
                 ).focus(),
                 id="main",
             ),
+            MetricsPanel(id="metrics-panel"),
         )
 
     def on_mount(self) -> None:
-        self._update_app()
+        self.watch(
+            self.query_one(MessageView),
+            "scroll_y",
+            self._on_message_scroll,
+            init=False,
+        )
+        self.run_worker(self._update_app(), exclusive=True, group="app")
+        if config.settings.metrics_export:
+            self.set_interval(
+                config.settings.metrics_export_interval, self._export_metrics
+            )
+
+    def on_ready(self) -> None:
+        # First frame is on screen, friends and messages still on their way
+        metrics.record("first frame", time.perf_counter() - self.created)
 
     def on_list_view_selected(self, event: ListView.Selected) -> None:
         if event.item.id.startswith("friend-"):
-            selected_id = int(event.item.id.split("-")[-1])
-            self.chatroom_id = self.friends[selected_id]["chatroom_id"]
-            self._update_messages()
-
-            # Stop existing update thread if any
-            if self.update_thread and self.should_update:
-                self.should_update = False
-                self.update_thread.join()
+            friend = next(
+                friend
+                for friend in self.session.friends
+                if list_item_id("friend", friend["id"]) == event.item.id
+            )
+            self._open_room(friend)
+        elif event.item.id.startswith("search-"):
+            chatroom_id = self.search_results[event.item.id]["chatroom_id"]
+            # The room may belong to another profile, the shown one is preferred
+            for session in [self.session, *self.sessions.values()]:
+                friend = next(
+                    (f for f in session.friends if f["chatroom_id"] == chatroom_id),
+                    None,
+                )
+                if friend is not None:
+                    self._switch_session(session, friend)
+                    return
+            self.notify("This chatroom is no longer in your friends")
 
-            # Start new update thread
-            self.should_update = True
-            self.update_thread = threading.Thread(target=self._background_update)
-            self.update_thread.daemon = True  # 讓線程隨主程式結束而結束
-            self.update_thread.start()
+    def on_input_changed(self, event: Input.Changed) -> None:
+        if event.input.id == "input-search":
+            self._search(event.value)
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "button-friends":
             # Stop message updates before opening modal
-            if self.update_thread and self.should_update:
-                self.should_update = False
-                self.update_thread.join()
-            self.push_screen(FriendModal(self.user_id))
+            self._stop_updates()
+            self.push_screen(
+                FriendModal(self.session.user_id), callback=self._resume_updates
+            )
         elif event.button.id == "button-login":
-            result = login_flow()
-            if result["status"] == "failed":
-                self.notify(result["message"])
-            else:
-                self.notify("Login successful")
-            self._update_app()
+            self._login()
+        elif event.button.id == "button-profile":
+            self.action_next_profile()
 
     def on_key(self, event: events.Key) -> None:
+        search = self.query_one("#input-search", Input)
+        if self.focused is search:
+            if event.key == "escape":
+                search.value = ""
+            elif event.key == "down" and self.search_results:
+                self.query_one("#listview-search").focus()
+            return
+
         if event.key == "enter":
-            self._send_message(self.query_one(Input).value)
-            self.query_one(Input).value = ""
+            message_input = self.query_one("#input-message", Input)
+            self._queue_message(message_input.value)
+            message_input.value = ""
+
+    def action_toggle_metrics(self) -> None:
+        panel = self.query_one(MetricsPanel)
+        panel.display = not panel.display
+        panel.refresh_metrics()
+
+    def action_next_profile(self) -> None:
+        profiles = list(self.sessions)
+        if len(profiles) < 2:
+            self.notify("Log in with `chat-terminal --profile NAME login` to add one")
+            return
+        index = (profiles.index(self.session.profile) + 1) % len(profiles)
+        self._switch_session(self.sessions[profiles[index]])
 
-    def on_screen_resume(self) -> None:
-        # Resume message updates when returning from modal
-        if self.chatroom_id:
-            self.should_update = True
-            self.update_thread = threading.Thread(target=self._background_update)
-            self.update_thread.daemon = True
-            self.update_thread.start()
+    def _resume_updates(self, _=None) -> None:
+        # Resume message updates when the modal is dismissed
+        if self.session.chatroom_id:
+            self._start_updates()
+
+    def on_app_blur(self) -> None:
+        if config.settings.pause_when_unfocused:
+            self.poll_scheduler.pause()
+            self.room_scheduler.pause()
+
+    def on_app_focus(self) -> None:
+        self.poll_scheduler.resume()
+        self.room_scheduler.resume()
 
     def on_unmount(self) -> None:
         """Called when the app is about to be unmounted."""
         try:
-            # Stop update thread if running
-            if self.update_thread and self.should_update:
-                self.should_update = False
-                if self.update_thread.is_alive():
-                    self.update_thread.join(timeout=1.0)  # 設定超時時間避免卡住
+            self._stop_updates()
+            if config.settings.metrics_export:
+                metrics.export()
+            client.close()
+            store.close()
         except Exception:
             pass  # 忽略清理過程中的錯誤
 
-    def _background_update(self):
-        while self.should_update:
-            self._update_messages()
-            time.sleep(config.settings.refresh_interval)
+    async def _export_metrics(self):
+        await client.call(metrics.export)
+
+    @work(exclusive=True, group="profile")
+    async def _switch_session(self, session: Session, friend: dict = None):
+        if session is not self.session:
+            self._stop_updates()
+            self.session = session
+            config.set_profile(session.profile)
+            self.query_one(MessageView).user_id = session.user_id
+            self._clear_messages()
+            await self._render_friends()
+            self._update_profile_button()
+            if friend is None and session.chatroom_id:
+                # Back to the room left open, its sync position was kept
+                session.room_watcher.mark_read(session.chatroom_id)
+                self._update_friend_labels()
+                self._highlight_friend(session.chatroom_id)
+                self._start_updates()
+                return
+        if friend is not None:
+            self._highlight_friend(friend["chatroom_id"])
+            self._open_room(friend)
+
+    def _highlight_friend(self, chatroom_id: str):
+        friend_list = self.query_one("#listview-friend")
+        for index, friend in enumerate(self.session.friends):
+            if friend["chatroom_id"] == chatroom_id:
+                friend_list.index = index
+                return
+
+    def _update_profile_button(self):
+        # Counts unread messages of the profiles not shown
+        unread = sum(
+            session.unread()
+            for session in self.sessions.values()
+            if session is not self.session
+        )
+        label = self.session.profile
+        self.query_one("#button-profile", Button).label = (
+            f"{label} (+{unread})" if unread else label
+        )
+
+    def _open_room(self, friend: dict):
+        self.session.chatroom_id = friend["chatroom_id"]
+        self.session.room_watcher.mark_read(self.session.chatroom_id)
+        self._update_friend_labels()
+        self.session.message_sync.reset(self.session.chatroom_id)
+        # The previous room stays on screen until the cached history of this
+        # one replaces it, without an empty frame in between. Loading history
+        # waits for that.
+        self.history_skip = 0
+        self.history_complete = True
+        self.detached = False
+        self._start_updates()
+
+    @work(exclusive=True, group="search")
+    async def _search(self, query: str):
+        # Exclusive, so a keystroke within the delay replaces the pending search
+        await asyncio.sleep(0.15)
+        with metrics.timer("search"):
+            results = await client.call(store.search, query)
+
+        names = {
+            friend["chatroom_id"]: friend["name"]
+            for session in [*self.sessions.values(), self.session]
+            for friend in session.friends
+        }
+        self.search_results = {
+            list_item_id("search", msg["chatroom_id"], message_key(msg)): msg
+            for msg in results
+        }
+        search_list = self.query_one("#listview-search")
+        await reconcile_list_view(
+            search_list,
+            self.search_results,
+            lambda item_id, msg: ListItem(
+                Label(self._search_label(msg, names)), id=item_id
+            ),
+            lambda item, msg: item.query_one(Label).update(
+                self._search_label(msg, names)
+            ),
+        )
+        search_list.display = bool(self.search_results)
+        if self.search_results and search_list.index is None:
+            search_list.index = 0
+
+    def _search_label(self, message: dict, names: dict) -> Text:
+        name = names.get(message["chatroom_id"], message["chatroom_id"])
+        return Text(f"{name}: {message['content']}")
+
+    def _start_updates(self):
+        self.poll_scheduler.reset()
+        # Exclusive: starting updates for a room cancels those of the previous one
+        self.run_worker(
+            self._background_update(self.session.chatroom_id),
+            exclusive=True,
+            group="messages",
+        )
 
-    def _update_messages(self):
+    def _stop_updates(self):
+        self.workers.cancel_group(self, "messages")
+
+    async def _background_update(self, chatroom_id: str):
+        # Render the cached history first, then reconcile with the server
+        cached = await client.call(self.session.message_sync.cached, chatroom_id)
+        self._queue_update(chatroom_id, cached, replace=True, cached=True)
+        await self._update_messages(chatroom_id)
+        while True:
+            if self.stream_supported:
+                await self._stream_messages(chatroom_id)
+            await self.poll_scheduler.wait()
+            await self._update_messages(chatroom_id)
+
+    async def _stream_messages(self, chatroom_id: str):
+        stream = MessageStream(chatroom_id, self.session.user_id)
         try:
-            richlog = self.query_one("#richlog-message")
-            messages_list = fetch_messages(self.chatroom_id, self.user_id)
-            messages_list.reverse()
-            messages = "\n".join(
-                [format_message(msg, self.user_id) for msg in messages_list]
+            await client.call(stream.open)
+        except StreamUnsupported as e:
+            log.warning(f"Message stream unsupported, falling back to polling: {e}")
+            self.stream_supported = False
+            return
+        except requests.RequestException as e:
+            log.error(f"Failed to open message stream: {e}")
+            self.poll_scheduler.failure()
+            return
+
+        try:
+            # Catch up on anything sent while the stream was (re)connecting
+            await self._update_messages(chatroom_id)
+            async for message in stream:
+                messages_list = await client.call(
+                    self.session.message_sync.push, chatroom_id, [message]
+                )
+                self._queue_update(chatroom_id, messages_list)
+        except requests.RequestException as e:
+            log.error(f"Message stream interrupted: {e}")
+        except Exception as e:
+            # A bad event must not take the app down, reopened after a backoff
+            log.error(f"Message stream failed: {e}")
+            self.poll_scheduler.failure()
+        finally:
+            # Also when cancelled, e.g. on switching rooms
+            stream.close()
+
+    async def _update_messages(self, chatroom_id: str = None):
+        chatroom_id = chatroom_id or self.session.chatroom_id
+        # One sync per room at a time, callers meanwhile wait for the same one
+        key = (self.session.profile, chatroom_id)
+        sync = self.syncs.get(key)
+        if sync is None or sync.done():
+            sync = self.syncs[key] = asyncio.ensure_future(
+                self._sync_messages(chatroom_id)
             )
-            richlog.clear()
-            richlog.write(messages)
+        # Shielded so that messages consumed by a sync are still shown when
+        # the worker awaiting it is cancelled, e.g. when the friends modal opens
+        await asyncio.shield(sync)
+
+    async def _sync_messages(self, chatroom_id: str):
+        try:
+            with metrics.timer("sync"):
+                messages_list, replace = await client.call(
+                    self.session.message_sync.sync, chatroom_id, self.session.user_id
+                )
         except Exception as e:
-            self.notify(f"Error updating messages: {str(e)}")
+            self.poll_scheduler.failure()
+            # Only report the first failure of a streak, polls keep backing off
+            if self.poll_scheduler.failures == 1:
+                self.notify(f"Error updating messages: {str(e)}")
+            return
 
-    def _update_friends(self):
-        self.query_one("#listview-friend").clear()
-        self.friends = fetch_friends(self.user_id)
+        if messages_list:
+            self.poll_scheduler.activity()
+        else:
+            self.poll_scheduler.idle()
+        self._queue_update(chatroom_id, messages_list, replace)
+
+    def _queue_update(
+        self,
+        chatroom_id: str,
+        messages_list: list,
+        replace: bool = False,
+        cached: bool = False,
+    ):
+        if not messages_list and not replace:
+            return
+        self.pending_updates.append((chatroom_id, messages_list, replace, cached))
+        if self.update_timer is None:
+            self.update_timer = self.set_timer(UPDATE_INTERVAL, self._flush_updates)
+
+    def _flush_updates(self):
+        """Apply the queued message updates, merged into one per room."""
+        if self.update_timer is not None:
+            self.update_timer.stop()
+            self.update_timer = None
+        updates, self.pending_updates = self.pending_updates, []
+
+        # Per room: messages, whether they replace what is shown, and how
+        # many of the first ones come from the cache
+        merged = {}
+        for chatroom_id, messages_list, replace, cached in updates:
+            # A replacement makes the updates queued before it moot
+            if replace or chatroom_id not in merged:
+                count = len(messages_list) if cached else 0
+                merged[chatroom_id] = (list(messages_list), replace, count)
+            else:
+                merged[chatroom_id][0].extend(messages_list)
+        metrics.count("updates merged", len(updates) - len(merged))
+        for chatroom_id, (messages_list, replace, cached) in merged.items():
+            self._show_messages(chatroom_id, messages_list, replace, cached)
+
+    def _show_messages(
+        self,
+        chatroom_id: str,
+        messages_list: list,
+        replace: bool = False,
+        cached: int = 0,
+    ):
+        if chatroom_id != self.session.chatroom_id:
+            return
+        if not messages_list and not replace:
+            return
+
+        if replace:
+            self._clear_messages()
 
-        timestamp = int(time.time())
-        for i, friend in enumerate(self.friends):
-            self.query_one("#listview-friend").append(
-                ListItem(Label(friend["name"]), id=f"friend-{timestamp}-{i}")
+        self.history_skip += len(messages_list)
+        # Cached messages were synced before, they are never a pending echo
+        replaced = self._take_echoes(chatroom_id, messages_list[cached:])
+        if self.detached:
+            # Scrolled back through history, shown once the user returns
+            return
+
+        metrics.count("messages shown", len(messages_list))
+        with metrics.timer("render"):
+            message_view = self.query_one(MessageView)
+            fresh = []
+            for message in messages_list:
+                echo_id = replaced.get(message_key(message))
+                if echo_id is None or not message_view.update(message, key=echo_id):
+                    fresh.append(message)
+            message_view.append(fresh)
+            if replace:
+                self._show_echoes(chatroom_id)
+                message_view.scroll_end(animate=False, immediate=False, x_axis=False)
+                self.call_after_refresh(self._fill_messages)
+            overflow = (
+                len(message_view.messages) - config.settings.max_rendered_messages
             )
+            if overflow > 0:
+                message_view.drop_oldest(overflow)
+                self.history_skip -= overflow
+                self.history_complete = False
+
+    def _clear_messages(self):
+        # An older page loading now would be placed against the old window
+        self.workers.cancel_group(self, "history")
+        self.history_skip = 0
+        self.history_complete = False
+        self.detached = False
+        self.query_one(MessageView).clear()
+
+    def _on_message_scroll(self, scroll_y: float):
+        message_view = self.query_one(MessageView)
+        if not message_view.messages or message_view.max_scroll_y == 0:
+            return
 
-    def _send_message(self, content: str):
-        if not content.strip():
+        if scroll_y == 0 and not self.history_complete:
+            self._load_older_messages()
+        elif self.detached and scroll_y >= message_view.max_scroll_y:
+            self._load_latest_messages()
+
+    def _fill_messages(self):
+        # Without overflow there is no scrolling up to load older messages
+        message_view = self.query_one(MessageView)
+        if (
+            message_view.messages
+            and message_view.max_scroll_y == 0
+            and not self.history_complete
+            and not self.detached
+        ):
+            self._load_older_messages()
+
+    @work(exclusive=True, group="history")
+    async def _load_older_messages(self):
+        # Counts what is rendered, so whatever is still queued goes first
+        self._flush_updates()
+        chatroom_id = self.session.chatroom_id
+        page = await client.call(
+            fetch_messages, chatroom_id, self.session.user_id, skip=self.history_skip
+        )
+        if chatroom_id != self.session.chatroom_id:
+            return
+        if len(page) < config.settings.max_messages:
+            self.history_complete = True
+        if not page:
             return
 
-        if not send_message(self.chatroom_id, self.user_id, content):
-            self.query_one("#richlog-message").write("send message failed")
+        await client.call(store.add, chatroom_id, page)
+        page.reverse()
+        # The page overlaps when messages arrived since the last sync
+        message_view = self.query_one(MessageView)
+        known = {message_key(msg) for msg in message_view.messages}
+        older = [msg for msg in page if message_key(msg) not in known]
+        self.history_skip += len(older)
+
+        message_view.prepend(older)
+        overflow = len(message_view.messages) - config.settings.max_rendered_messages
+        if overflow > 0:
+            message_view.drop_newest(overflow)
+            self.detached = True
+        elif older:
+            self.call_after_refresh(self._fill_messages)
+
+    @work(exclusive=True, group="history")
+    async def _load_latest_messages(self):
+        chatroom_id = self.session.chatroom_id
+        messages_list = await client.call(
+            store.recent, chatroom_id, config.settings.max_rendered_messages
+        )
+        if chatroom_id != self.session.chatroom_id or not self.detached:
             return
 
-        self._update_messages()
+        # Queued messages were stored before being queued, so they are in
+        # what was read; applied while still detached they are only dropped
+        self._flush_updates()
+        self.history_skip = len(messages_list)
+        self.history_complete = False
+        self.detached = False
+        self.query_one(MessageView).set_messages(messages_list)
+        self._show_echoes(chatroom_id)
+
+    async def _update_friends(self, session: Session = None):
+        session = session or self.session
+        with config.use_profile(session.profile):
+            session.friends = await client.call(fetch_friends, session.user_id)
+        if session is self.session:
+            await self._render_friends()
+
+    async def _watch_rooms(self):
+        # One chatrooms listing per profile covers all of its rooms, instead of
+        # a poller per room
+        while True:
+            changed = False
+            for session in list(self.sessions.values()):
+                with config.use_profile(session.profile):
+                    session.chatrooms = await client.call(
+                        fetch_chatrooms, session.user_id
+                    )
+                # Rooms left open in another profile still count as unread
+                shown = session is self.session
+                if session.room_watcher.update(
+                    session.chatrooms, session.chatroom_id if shown else None
+                ):
+                    changed = True
+                    if shown:
+                        await self._render_friends()
+            if changed:
+                self.room_scheduler.activity()
+                self._update_profile_button()
+            else:
+                self.room_scheduler.idle()
+            await self.room_scheduler.wait()
+
+    async def _render_friends(self):
+        async with self.friends_lock:
+            await self._reconcile_friends()
+
+    async def _reconcile_friends(self):
+        # Most recently active rooms first, rooms without activity keep their order
+        self.session.friends = sorted(
+            self.session.friends,
+            key=lambda friend: self.session.room_watcher.activity.get(
+                friend["chatroom_id"], ""
+            ),
+            reverse=True,
+        )
+        await reconcile_list_view(
+            self.query_one("#listview-friend"),
+            {
+                list_item_id("friend", friend["id"]): friend
+                for friend in self.session.friends
+            },
+            lambda item_id, friend: ListItem(
+                Label(self._friend_label(friend)), id=item_id
+            ),
+            lambda item, friend: item.query_one(Label).update(
+                self._friend_label(friend)
+            ),
+        )
+
+    def _update_friend_labels(self):
+        items = self.query_one("#listview-friend").children
+        for item, friend in zip(items, self.session.friends):
+            item.query_one(Label).update(self._friend_label(friend))
+
+    def _friend_label(self, friend: dict) -> str:
+        unread = self.session.room_watcher.unread.get(friend["chatroom_id"], 0)
+        if unread:
+            return f"{friend['name']} ({unread})"
+        return friend["name"]
 
-    def _update_app(self):
-        auth = get_auth()
-        if not auth:
+    def _queue_message(self, content: str):
+        if not content.strip() or not self.session.chatroom_id:
             return
 
+        message = outbox.add(self.session.chatroom_id, self.session.user_id, content)
+        self.session.echoes.append(message)
+        if not self.detached:
+            self.query_one(MessageView).append([message])
+        self.outbox_ready.set()
+        self.send_scheduler.wake()
+
+    async def _drain_outbox(self):
+        # One message at a time, so they reach the server in the order typed
+        while True:
+            message = outbox.next()
+            if message is None:
+                self.outbox_ready.clear()
+                await self.outbox_ready.wait()
+                continue
+
+            session = self._session_of(message["sender_id"])
+            try:
+                with config.use_profile(session.profile):
+                    await client.call(
+                        post_message,
+                        message["chatroom_id"],
+                        message["sender_id"],
+                        message["content"],
+                        message["id"],
+                    )
+            except Exception as e:
+                log.error(f"Failed to send message: {e}")
+                if is_undelivered(e):
+                    # Kept in the outbox and retried, with backoff
+                    self.send_scheduler.failure()
+                    await self.send_scheduler.wait()
+                    continue
+                await client.call(outbox.remove, message["id"])
+                if isinstance(e, requests.RequestException) and not isinstance(
+                    e, requests.HTTPError
+                ):
+                    # May have arrived, resending could post it twice. The
+                    # local copy stays until the server copy replaces it.
+                    self._set_echo_status(message, "unconfirmed")
+                    self.notify("message may not have been sent")
+                else:
+                    self._set_echo_status(message, "failed")
+                    self.notify("send message failed")
+                continue
+
+            self.send_scheduler.reset()
+            await client.call(outbox.remove, message["id"])
+            self._set_echo_status(message, None)
+            # Sync once a burst of messages is out, not after each one
+            chatroom_id = message["chatroom_id"]
+            if (
+                session is self.session
+                and chatroom_id == session.chatroom_id
+                and not outbox.pending_for(chatroom_id)
+            ):
+                self.poll_scheduler.activity()
+                self.poll_scheduler.wake()
+
+    def _show_echoes(self, chatroom_id: str):
+        # After the view was cleared, put the local copies back below the history
+        if self.detached:
+            return
+        self.query_one(MessageView).append(
+            [msg for msg in self.session.echoes if msg["chatroom_id"] == chatroom_id]
+        )
+
+    def _take_echoes(self, chatroom_id: str, messages_list: list) -> dict:
+        """Match server messages to the local copies they replace."""
+        replaced = {}
+        for message in messages_list:
+            echo = next(
+                (
+                    e
+                    for e in self.session.echoes
+                    if e["chatroom_id"] == chatroom_id and self._is_echo_of(e, message)
+                ),
+                None,
+            )
+            if echo is not None:
+                self.session.echoes.remove(echo)
+                replaced[message_key(message)] = echo["id"]
+        return replaced
+
+    def _is_echo_of(self, echo: dict, message: dict) -> bool:
+        if message.get("client_id"):
+            return message["client_id"] == echo["id"]
+        # Servers not returning the client id: same text from the same
+        # sender, not older than the local copy
+        if (
+            echo["sender_id"] != message["sender_id"]
+            or echo["content"] != message["content"]
+        ):
+            return False
         try:
-            if self.update_thread and self.should_update:
-                self.should_update = False
-                if self.update_thread.is_alive():
-                    self.update_thread.join(timeout=1.0)
-        except Exception:
-            pass
+            return utc_timestamp(message["sent_at"]) >= utc_timestamp(echo["sent_at"])
+        except ValueError:
+            return False
+
+    def _set_echo_status(self, message: dict, status: str = None):
+        session = self._session_of(message["sender_id"])
+        for i, echo in enumerate(session.echoes):
+            if echo["id"] != message["id"]:
+                continue
+            echo = {key: value for key, value in echo.items() if key != "status"}
+            if status:
+                echo["status"] = status
+            if status == "failed":
+                del session.echoes[i]
+            else:
+                session.echoes[i] = echo
+            if session is self.session:
+                self.query_one(MessageView).update(echo)
+            return
 
-        self.user_id = auth.get("user_id")
-        self.chatroom_id = None
-        self.chatrooms = []
-        self.friends = []
+    def _session_of(self, user_id: str) -> Session:
+        return next(
+            (s for s in self.sessions.values() if s.user_id == user_id), self.session
+        )
+
+    @work(exclusive=True, group="login")
+    async def _login(self):
+        # Runs on the executor, progress is handed over to the event loop
+        flow = LoginFlow(
+            lambda message: self.call_from_thread(modal.show_progress, message)
+        )
+        modal = LoginModal(flow)
+        await self.push_screen(modal)
+        try:
+            result = await client.call(flow.run)
+        except asyncio.CancelledError:
+            flow.cancel()
+            raise
+        finally:
+            if modal.is_current:
+                modal.dismiss()
+
+        if result["status"] == "cancelled":
+            return
+        if result["status"] == "failed":
+            self.notify(result["message"])
+        else:
+            self.notify("Login successful")
+        await self._update_app()
+
+    async def _update_app(self):
+        sessions = {}
+        for profile in await client.call(config.profiles):
+            with config.use_profile(profile):
+                # May refresh the token, so off the event loop like any request
+                auth = await client.call(get_auth)
+            if auth:
+                sessions[profile] = Session(profile, auth.get("user_id"))
+        session = sessions.get(config.profile)
+        if session is None:
+            return
+
+        self._stop_updates()
+
+        self.sessions = sessions
+        self.session = session
+        self.query_one(MessageView).user_id = session.user_id
+        # Messages left unsent by the last run go out first
+        pending = await client.call(outbox.pending_for)
+        for each in sessions.values():
+            each.echoes = [msg for msg in pending if msg["sender_id"] == each.user_id]
         self.query_one("#listview-friend").clear()
-        self.query_one("#richlog-message").clear()
-        self._update_friends()
+        self._clear_messages()
+        self._update_profile_button()
+        await self._update_friends()
+        # Other profiles' friends, for their unread counts and search results
+        await asyncio.gather(
+            *(
+                self._update_friends(each)
+                for each in sessions.values()
+                if each is not session
+            )
+        )
+        self.run_worker(self._watch_rooms(), exclusive=True, group="rooms")
+        self.outbox_ready.set()
+        self.run_worker(self._drain_outbox(), exclusive=True, group="outbox")
 
 
 def start():
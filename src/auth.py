@@ -1,83 +1,221 @@
 import json
 import os
+import threading
 import time
-import webbrowser
 from datetime import datetime
-from typing import Dict, Optional
-
-import requests
+from typing import TYPE_CHECKING, Callable, Dict, Optional
 
+from .client import client
 from .config import config
+from .log import log
+
+if TYPE_CHECKING:
+    from .models import AuthData
+
+_auth_lock = threading.Lock()
+# Both per profile
+_auth_dicts: Dict[str, tuple] = {}
+_last_refresh: Dict[str, float] = {}
+REFRESH_RETRY_INTERVAL = 30
+# Seconds to wait for the browser before giving up
+LOGIN_TIMEOUT = 30
+CANCELLED = {"status": "cancelled", "message": "Login cancelled"}
 
 
 def get_auth() -> Optional[Dict]:
     auth_data = config.get_auth()
-    if auth_data:
-        return auth_data.dict()
-    return None
-
+    if auth_data and auth_data.expires_within(config.settings.auth_refresh_margin):
+        auth_data = refresh_token(auth_data)
+    if not auth_data:
+        return None
 
-def start_oauth_flow():
+    # Hand out the same dict until the cached AuthData changes
+    profile = config.profile
+    cached_data, cached_dict = _auth_dicts.get(profile, (None, None))
+    if cached_data is not auth_data:
+        cached_dict = auth_data.dict()
+        _auth_dicts[profile] = (auth_data, cached_dict)
+    return cached_dict
+
+
+def refresh_token(auth_data: "AuthData") -> Optional["AuthData"]:
+    profile = config.profile
+    with _auth_lock:
+        # Another thread may have refreshed while we waited for the lock
+        current = config.get_auth()
+        if current is not auth_data and current is not None:
+            return current
+
+        if time.time() - _last_refresh.get(profile, 0.0) >= REFRESH_RETRY_INTERVAL:
+            _last_refresh[profile] = time.time()
+            try:
+                response = client.post(
+                    "/auth/refresh",
+                    headers={"Authorization": f"Bearer {auth_data.session_token}"},
+                )
+                data = response.json()
+                if response.status_code == 200 and "session_token" in data:
+                    data.setdefault("user_id", auth_data.user_id)
+                    if save_token(data):
+                        return config.get_auth()
+                else:
+                    log.error(f"Failed to refresh token: {response.status_code}")
+            except Exception as e:
+                log.error(f"Failed to refresh token: {e}")
+
+    # Keep using a token that is only about to expire, drop an expired one
+    return None if auth_data.is_expired() else auth_data
+
+
+def start_oauth_flow(redirect_uri: str = None, progress: Callable = None):
     try:
-        response = requests.get(f"{config.settings.server_url}/auth/login")
+        params = {"redirect_uri": redirect_uri} if redirect_uri else None
+        response = client.get("/auth/login", params=params)
         data = response.json()
 
         if "client_id" in data:
             client_id = data["client_id"]
             auth_url = data.get("auth_url")
             if auth_url:
+                import webbrowser
+
                 webbrowser.open(auth_url)
+                if progress:
+                    progress(f"Log in with the browser, or open {auth_url}")
             return client_id
         return None
     except Exception:
         return None
 
 
-def wait_for_auth_completion(client_id: str):
-    MAX_RETRIES = 30
-    retry_count = 0
-
-    while retry_count < MAX_RETRIES:
-        try:
-            response = requests.get(
-                f"{config.settings.server_url}/auth/token/{client_id}"
-            )
-            data = response.json()
-
-            if "status" in data and data["status"] == "pending":
-                time.sleep(1)
-                retry_count += 1
-                continue
-
-            if "user_id" in data:
-                return data
-            return None
-        except Exception:
-            time.sleep(1)
-            retry_count += 1
-            continue
-    return None
-
-
 def save_token(data: Dict) -> bool:
     return config.save_auth(data)
 
 
-def login_flow() -> Dict:
-    # Step 1: Start OAuth flow
-    client_id = start_oauth_flow()
-    if not client_id:
-        return {"status": "failed", "message": "Failed to start OAuth flow"}
+class CallbackListener:
+    """Local address the browser is sent back to once it is done logging in.
+
+    The request only wakes the login up, the token is still fetched from the
+    chat server. Servers that ignore ``redirect_uri`` are simply polled.
+    """
+
+    def __init__(self, wake: threading.Event):
+        self.wake = wake
+        self._server = None
+
+    def start(self) -> str:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = b"Login complete, you can close this tab."
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                listener.wake.set()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = HTTPServer(("127.0.0.1", 0), Handler)
+        # Polled often, so closing it does not hold the login up
+        threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}/callback"
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class LoginFlow:
+    """Browser login that can be followed through ``progress`` and cancelled.
+
+    ``run`` blocks until the login succeeds, fails or is cancelled from
+    another thread, and ``progress`` is called from the thread running it.
+    """
+
+    def __init__(self, progress: Callable[[str], None] = None):
+        self.progress = progress or (lambda message: None)
+        self.cancelled = False
+        self._wake = threading.Event()
+
+    def cancel(self):
+        self.cancelled = True
+        self._wake.set()
+
+    def run(self) -> Dict:
+        listener = None
+        redirect_uri = None
+        if config.settings.login_callback:
+            listener = CallbackListener(self._wake)
+            try:
+                redirect_uri = listener.start()
+            except OSError as e:
+                log.warning(f"Login callback unavailable, polling instead: {e}")
+                listener = None
 
-    # Step 2: Wait for authorization completion
-    auth_data = wait_for_auth_completion(client_id)
-    if not auth_data:
-        return {
-            "status": "failed",
-            "message": "Failed to wait for authorization completion",
-        }
+        try:
+            return self._run(redirect_uri)
+        finally:
+            if listener is not None:
+                listener.close()
+
+    def _run(self, redirect_uri: str) -> Dict:
+        # Step 1: Start OAuth flow
+        self.progress("Opening the browser")
+        client_id = start_oauth_flow(redirect_uri, self.progress)
+        if self.cancelled:
+            return CANCELLED
+        if not client_id:
+            return {"status": "failed", "message": "Failed to start OAuth flow"}
+
+        # Step 2: Wait for authorization completion
+        auth_data = self._wait_for_auth_completion(client_id)
+        if self.cancelled:
+            return CANCELLED
+        if not auth_data:
+            return {
+                "status": "failed",
+                "message": "Failed to wait for authorization completion",
+            }
+
+        # Step 3: Save token
+        save_token(auth_data)
+
+        return {"status": "success", "message": "Login successful"}
+
+    def _wait_for_auth_completion(self, client_id: str) -> Optional[Dict]:
+        # Polled once a second, or as soon as woken by the callback or cancel
+        deadline = time.monotonic() + LOGIN_TIMEOUT
+        while time.monotonic() < deadline and not self.cancelled:
+            try:
+                response = client.get(f"/auth/token/{client_id}")
+                data = response.json()
+
+                if "status" in data and data["status"] == "pending":
+                    remaining = int(deadline - time.monotonic())
+                    self.progress(f"Waiting for the browser, {remaining}s left")
+                    self._wake.wait(1)
+                    self._wake.clear()
+                    continue
+
+                if "user_id" in data:
+                    return data
+                return None
+            except Exception:
+                self._wake.wait(1)
+                self._wake.clear()
+                continue
+        return None
 
-    # Step 3: Save token
-    save_token(auth_data)
 
-    return {"status": "success", "message": "Login successful"}
+def login_flow(progress: Callable[[str], None] = None) -> Dict:
+    return LoginFlow(progress).run()
@@ -1,26 +1,55 @@
+import asyncio
+import json
 import threading
 import time
-from datetime import datetime
-from typing import Dict, List
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 import requests
-from textual import events, log
-from textual.app import App, ComposeResult
-from textual.containers import Container, Horizontal, Vertical
-from textual.widgets import Input, Label, ListItem, ListView, RichLog
 
 from .auth import get_auth
+from .client import client
 from .config import config
+from .log import log
+
+FORMAT_CACHE_SIZE = 4096
+
+
+def parse_timestamp(value: str) -> datetime:
+    # Much faster than strptime, and also accepts timestamps without
+    # microseconds or with a UTC offset
+    return datetime.fromisoformat(value)
+
+
+MESSAGE_STATUS = {
+    "pending": " [dim](sending)[/dim]",
+    "unconfirmed": " [yellow](not confirmed)[/yellow]",
+    "failed": " [red](not sent)[/red]",
+}
 
 
 def format_message(message: Dict, user_id: str) -> str:
-    content = message["content"]
-    sent_at = datetime.strptime(message["sent_at"], "%Y-%m-%dT%H:%M:%S.%f").strftime(
-        config.settings.time_format
-    )
     color = "gray" if message["sender_id"] == user_id else "green"
+    return _format_line(
+        message["sent_at"],
+        message["content"],
+        color,
+        config.settings.time_format,
+        message.get("status"),
+    )
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _format_line(
+    sent_at: str, content: str, color: str, time_format: str, status: str = None
+) -> str:
+    try:
+        sent_at = parse_timestamp(sent_at).strftime(time_format)
+    except ValueError:
+        log.error(f"Invalid message timestamp: {sent_at}")
 
-    return f"[{sent_at}] [{color}]{content}[/{color}]"
+    return f"[{sent_at}] [{color}]{content}[/{color}]{MESSAGE_STATUS.get(status, '')}"
 
 
 def fetch_chatrooms(user_id: str) -> List[Dict]:
@@ -32,69 +61,397 @@ def fetch_chatrooms(user_id: str) -> List[Dict]:
     headers = {"Authorization": f"Bearer {session_token}"}
 
     try:
-        response = requests.get(
-            f"{config.settings.server_url}/chat/chatrooms",
+        data = client.get_json(
+            "/chat/chatrooms",
             params={"user_id": user_id},
             headers=headers,
         )
-        if response.status_code == 200:
-            return response.json().get("chatrooms", [])
-        else:
-            log.error(f"Failed to get chatrooms: {response.status_code}")
-            return []
+        return data.get("chatrooms", [])
     except Exception as e:
         log.error(f"Failed to get chatrooms: {e}")
         return []
 
 
 def fetch_messages(
-    chatroom_id: str, user_id: str, limit: int = None, skip: int = 0
+    chatroom_id: str,
+    user_id: str,
+    limit: int = None,
+    skip: int = 0,
+    since: Optional[str] = None,
+) -> List[Dict]:
+    try:
+        return get_messages(chatroom_id, user_id, limit, skip, since)
+    except Exception as e:
+        log.error(f"Failed to get messages: {e}")
+        return []
+
+
+def get_messages(
+    chatroom_id: str,
+    user_id: str,
+    limit: int = None,
+    skip: int = 0,
+    since: Optional[str] = None,
 ) -> List[Dict]:
+    """Like fetch_messages, but raises instead of returning no messages on failure."""
     if limit is None:
         limit = config.settings.max_messages
 
-    try:
-        response = requests.get(
-            f"{config.settings.server_url}/chat/chatrooms/{chatroom_id}/messages",
-            params={"user_id": user_id, "limit": limit, "skip": skip},
+    params = {"user_id": user_id, "limit": limit, "skip": skip}
+    if since:
+        params["since"] = since
+
+    data = client.get_json(
+        f"/chat/chatrooms/{chatroom_id}/messages",
+        params=params,
+    )
+    # A copy, the list may be the cached one and callers reorder it
+    return list(data.get("messages", []))
+
+
+class StreamUnsupported(Exception):
+    pass
+
+
+class MessageStream:
+    """Server-Sent Events subscription to the new messages of one chatroom."""
+
+    def __init__(self, chatroom_id: str, user_id: str):
+        self.chatroom_id = chatroom_id
+        self.user_id = user_id
+        self.response = None
+
+    def open(self):
+        headers = {"Accept": "text/event-stream"}
+        auth = get_auth()
+        if auth:
+            headers["Authorization"] = f"Bearer {auth.get('session_token')}"
+
+        response = client.get(
+            f"/chat/chatrooms/{self.chatroom_id}/stream",
+            params={"user_id": self.user_id},
+            headers=headers,
+            stream=True,
+            timeout=config.settings.stream_timeout,
         )
 
-        if response.status_code == 200:
-            return response.json().get("messages", [])
-        else:
-            log.error(f"Failed to get messages: {response.status_code}")
-            return []
-    except Exception as e:
-        log.error(f"Failed to get messages: {e}")
-        return []
+        content_type = response.headers.get("Content-Type", "")
+        if response.status_code in (404, 405, 406, 501) or (
+            response.status_code == 200
+            and not content_type.startswith("text/event-stream")
+        ):
+            response.close()
+            raise StreamUnsupported(f"{response.status_code} {content_type}")
+        if response.status_code != 200:
+            response.close()
+            response.raise_for_status()
+
+        self.response = response
+
+    def close(self):
+        if self.response is None:
+            return
+        # Closing waits for a read blocked in another thread, shutting the
+        # socket down ends that read at once
+        try:
+            self.response.raw.shutdown()
+        except (AttributeError, ValueError, RuntimeError, OSError):
+            # Older urllib3, or the connection is already gone
+            pass
+        self.response.close()
+
+    def __iter__(self) -> Iterator[Dict]:
+        # Event streams are always UTF-8, whatever the charset says
+        self.response.encoding = "utf-8"
+        data = []
+        for line in self.response.iter_lines(chunk_size=None, decode_unicode=True):
+            if line.startswith("data:"):
+                data.append(line[5:].removeprefix(" "))
+                continue
+            if line or not data:
+                # Comments (heartbeats), event names and ids carry no message
+                continue
+
+            try:
+                payload = json.loads("\n".join(data))
+            except ValueError as e:
+                log.error(f"Invalid message event: {e}")
+                payload = {}
+            data = []
+            if not isinstance(payload, dict):
+                log.error(f"Invalid message event: {payload!r}")
+                continue
+
+            if "messages" in payload:
+                messages = payload["messages"]
+            elif "content" in payload:
+                messages = [payload]
+            else:
+                continue
+            for message in messages:
+                if is_message(message):
+                    yield message
+                else:
+                    log.error(f"Dropped incomplete message event: {message!r}")
+
+    async def __aiter__(self) -> AsyncIterator[Dict]:
+        # Reads block until the next event, so they run on a daemon thread that
+        # never holds up shutdown. Once the consumer goes away the stream is
+        # closed, which ends the read the thread is blocked in.
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def deliver(item):
+            if stopped.is_set():
+                return
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed
+                stopped.set()
+
+        def pump():
+            try:
+                for message in self:
+                    if stopped.is_set():
+                        break
+                    deliver(message)
+            except Exception as e:
+                deliver(e)
+            finally:
+                self.close()
+                deliver(None)
+
+        threading.Thread(target=pump, daemon=True).start()
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            self.close()
 
 
 def send_message(chatroom_id: str, user_id: str, content: str) -> bool:
+    try:
+        post_message(chatroom_id, user_id, content)
+        return True
+    except Exception as e:
+        log.error(f"Failed to send message: {e}")
+        return False
+
+
+def post_message(chatroom_id: str, user_id: str, content: str, client_id: str = None):
+    """Like send_message, but raises instead of returning False on failure.
+
+    ``client_id`` identifies the local copy, for the server to drop a resent
+    duplicate and to return with the message.
+    """
     auth = get_auth()
     if not auth:
-        return False
+        raise PermissionError("Not logged in")
 
     session_token = auth.get("session_token")
     headers = {"Authorization": f"Bearer {session_token}"}
 
-    try:
-        response = requests.post(
-            f"{config.settings.server_url}/chat/messages",
-            json={
-                "chatroom_id": chatroom_id,
-                "sender_id": user_id,
-                "content": content,
-            },
-            headers=headers,
+    body = {"chatroom_id": chatroom_id, "sender_id": user_id, "content": content}
+    if client_id:
+        body["client_id"] = client_id
+    response = client.post("/chat/messages", json=body, headers=headers)
+    if response.status_code != 200:
+        raise requests.HTTPError(
+            f"{response.status_code}\n{response.text}", response=response
         )
 
-        if response.status_code == 200:
-            return True
-        else:
-            log.error(
-                f"Failed to send message: {response.status_code}\n{response.text}"
+
+def utc_timestamp(value: str) -> datetime:
+    """Parse a timestamp into naive UTC, for comparing local and server ones."""
+    parsed = parse_timestamp(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def is_message(value) -> bool:
+    """Whether ``value`` has the fields syncing and caching rely on."""
+    return isinstance(value, dict) and "sent_at" in value and "sender_id" in value
+
+
+def message_key(message: Dict) -> str:
+    return message.get("id") or f"{message['sent_at']}-{message['sender_id']}"
+
+
+class MessageSync:
+    """Tracks the newest message of each chatroom so refreshes only pull the delta.
+
+    The first sync of a room loads the full ``max_messages`` window. Later syncs
+    ask for messages ``since`` the newest one seen, in pages of
+    ``sync_page_size``, and stop at the first page that overlaps what we
+    already have. Servers that ignore ``since`` still only cost one small page
+    per idle tick.
+
+    With a ``store`` every synced message is cached on disk, and ``cached``
+    seeds a room from it so only messages newer than the cache are fetched.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Dict] = {}
+
+    def reset(self, chatroom_id: str = None):
+        with self._lock:
+            if chatroom_id is None:
+                self._latest.clear()
+            else:
+                self._latest.pop(chatroom_id, None)
+
+    def cached(self, chatroom_id: str) -> List[Dict]:
+        """Return the cached messages of ``chatroom_id``, oldest first."""
+        if self.store is None:
+            return []
+
+        messages = self.store.recent(chatroom_id)
+        with self._lock:
+            if messages and chatroom_id not in self._latest:
+                self._remember(chatroom_id, messages[::-1])
+        return messages
+
+    def sync(self, chatroom_id: str, user_id: str) -> Tuple[List[Dict], bool]:
+        """Return the messages not seen yet for ``chatroom_id``, oldest first.
+
+        Failed requests raise, so callers can tell them from an idle room.
+        The flag is set when the messages replace rather than extend what was
+        seen before: on the first sync of a room, or when nothing fetched
+        overlaps with the newest message we know about.
+        """
+        with self._lock:
+            latest = self._latest.get(chatroom_id)
+            if latest is None:
+                messages, replace = get_messages(chatroom_id, user_id), True
+            else:
+                messages, replace = self._fetch_newer(chatroom_id, user_id, latest)
+
+            if not messages:
+                return [], False
+
+            if replace:
+                self._latest.pop(chatroom_id, None)
+            self._remember(chatroom_id, messages)
+            if self.store is not None:
+                self.store.add(chatroom_id, messages)
+
+            messages.reverse()
+            return messages, replace
+
+    def push(self, chatroom_id: str, messages: List[Dict]) -> List[Dict]:
+        """Record messages delivered by a stream, returning the ones not seen yet."""
+        with self._lock:
+            latest = self._latest.get(chatroom_id)
+            if latest is not None:
+                messages = [msg for msg in messages if self._is_newer(msg, latest)]
+            if messages:
+                self._remember(chatroom_id, messages[::-1])
+                if self.store is not None:
+                    self.store.add(chatroom_id, messages)
+            return messages
+
+    def _fetch_newer(
+        self, chatroom_id: str, user_id: str, latest: Dict
+    ) -> Tuple[List[Dict], bool]:
+        page_size = config.settings.sync_page_size
+        newer = []
+        skip = 0
+        while True:
+            if skip >= config.settings.max_messages:
+                # A whole window of new messages, we lost track of the room
+                return newer, True
+            page = get_messages(
+                chatroom_id,
+                user_id,
+                limit=page_size,
+                skip=skip,
+                since=latest["sent_at"],
             )
-            return False
-    except Exception as e:
-        log.error(f"Failed to send message: {e}")
-        return False
+            fresh = [msg for msg in page if self._is_newer(msg, latest)]
+            newer.extend(fresh)
+            if len(fresh) < len(page) or len(page) < page_size:
+                return newer, False
+            skip += page_size
+
+    @staticmethod
+    def _is_newer(message: Dict, latest: Dict) -> bool:
+        if message["sent_at"] != latest["sent_at"]:
+            return message["sent_at"] > latest["sent_at"]
+        return message_key(message) not in latest["keys"]
+
+    def _remember(self, chatroom_id: str, messages: List[Dict]):
+        # Messages arrive newest first
+        sent_at = messages[0]["sent_at"]
+        keys = {message_key(msg) for msg in messages if msg["sent_at"] == sent_at}
+
+        latest = self._latest.get(chatroom_id)
+        if latest and latest["sent_at"] == sent_at:
+            keys |= latest["keys"]
+        self._latest[chatroom_id] = {"sent_at": sent_at, "keys": keys}
+
+
+def chatroom_id_of(chatroom: Dict) -> Optional[str]:
+    return chatroom.get("id") or chatroom.get("chatroom_id")
+
+
+def chatroom_activity(chatroom: Dict) -> Optional[str]:
+    last_message = chatroom.get("last_message") or {}
+    return (
+        chatroom.get("last_message_at")
+        or last_message.get("sent_at")
+        or chatroom.get("updated_at")
+    )
+
+
+class RoomWatcher:
+    """Follows activity in every chatroom through the single chatrooms listing.
+
+    Unread counts come from the server's ``unread_count`` when it reports one.
+    Otherwise each change of a room's last activity seen while the room is not
+    open counts as one unread message, without fetching the room itself.
+    """
+
+    def __init__(self):
+        self.activity: Dict[str, str] = {}
+        self.unread: Dict[str, int] = {}
+
+    def reset(self):
+        self.activity.clear()
+        self.unread.clear()
+
+    def update(self, chatrooms: List[Dict], open_chatroom_id: str = None) -> bool:
+        """Record a chatrooms listing, returning whether anything changed."""
+        changed = False
+        for chatroom in chatrooms:
+            chatroom_id = chatroom_id_of(chatroom)
+            if chatroom_id is None:
+                continue
+
+            activity = chatroom_activity(chatroom)
+            previous = self.activity.get(chatroom_id)
+            unread = self.unread.get(chatroom_id, 0)
+            if chatroom_id == open_chatroom_id:
+                unread = 0
+            elif "unread_count" in chatroom:
+                unread = chatroom["unread_count"]
+            elif previous is not None and activity and activity != previous:
+                unread += 1
+
+            if activity:
+                self.activity[chatroom_id] = activity
+            changed |= (activity is not None and activity != previous) or (
+                unread != self.unread.get(chatroom_id, 0)
+            )
+            self.unread[chatroom_id] = unread
+        return changed
+
+    def mark_read(self, chatroom_id: str):
+        self.unread[chatroom_id] = 0
@@ -0,0 +1,263 @@
+import argparse
+import json
+import sys
+import time
+from collections import deque
+from typing import Dict, Iterator, Tuple
+
+# Commands print one JSON object per line and never import Textual, only
+# running without a command starts the UI. Modules are imported by the
+# commands that need them, so --help and the UI start without the others.
+
+
+def emit(data: Dict):
+    print(json.dumps(data, ensure_ascii=False), flush=True)
+
+
+def current_user() -> str:
+    from .auth import get_auth
+
+    auth = get_auth()
+    if not auth:
+        sys.exit("Not logged in, run `chat-terminal login` first")
+    return auth["user_id"]
+
+
+def resolve_room(room: str, user_id: str) -> str:
+    """Accept a friend's name or id as well as a chatroom id."""
+    from .friends import fetch_friends
+
+    for friend in fetch_friends(user_id):
+        if room in (friend.get("name"), friend.get("id")):
+            return friend["chatroom_id"]
+    return room
+
+
+def cmd_login(args) -> int:
+    from .auth import login_flow
+
+    result = login_flow(lambda message: print(message, file=sys.stderr))
+    emit(result)
+    return 0 if result["status"] == "success" else 1
+
+
+def cmd_profiles(args) -> int:
+    from .config import config
+
+    for profile in config.profiles():
+        with config.use_profile(profile):
+            auth = config.get_auth()
+        emit({"profile": profile, "user_id": auth.user_id if auth else None})
+    return 0
+
+
+def cmd_friends(args) -> int:
+    from .friends import fetch_friends
+
+    for friend in fetch_friends(current_user()):
+        emit(friend)
+    return 0
+
+
+def cmd_send(args) -> int:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .chat import post_message
+
+    user_id = current_user()
+    rooms = {}
+
+    def room_of(name: str) -> str:
+        if name not in rooms:
+            rooms[name] = resolve_room(name, user_id)
+        return rooms[name]
+
+    room = room_of(args.room) if args.room else None
+
+    def outgoing() -> Iterator[Tuple[str, str]]:
+        if args.message:
+            yield room, " ".join(args.message)
+            return
+        for line in sys.stdin:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            if args.json:
+                data = json.loads(line)
+                target = room_of(data["room"]) if data.get("room") else room
+                yield target, data["content"]
+            else:
+                yield room, line
+
+    def send(chatroom_id: str, content: str) -> Dict:
+        result = {"room": chatroom_id, "content": content, "ok": True}
+        try:
+            if not chatroom_id:
+                raise ValueError("No room given")
+            post_message(chatroom_id, user_id, content)
+        except Exception as e:
+            result.update(ok=False, error=str(e))
+        return result
+
+    # Up to --concurrency sends in flight over the pooled connections, results
+    # are printed in input order
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        pending = deque()
+        for chatroom_id, content in outgoing():
+            pending.append(executor.submit(send, chatroom_id, content))
+            if len(pending) >= args.concurrency:
+                result = pending.popleft().result()
+                failed += not result["ok"]
+                emit(result)
+        while pending:
+            result = pending.popleft().result()
+            failed += not result["ok"]
+            emit(result)
+    return 1 if failed else 0
+
+
+def cmd_tail(args) -> int:
+    import requests
+
+    from .chat import MessageStream, MessageSync, StreamUnsupported
+    from .config import config
+
+    user_id = current_user()
+    room = resolve_room(args.room, user_id)
+    sync = MessageSync()
+
+    messages, _ = sync.sync(room, user_id)
+    for message in messages[-args.limit :] if args.limit else []:
+        emit(message)
+    if not args.follow:
+        return 0
+
+    stream_supported = config.settings.use_message_stream
+    while True:
+        if stream_supported:
+            stream = MessageStream(room, user_id)
+            try:
+                stream.open()
+                for message in stream:
+                    for new in sync.push(room, [message]):
+                        emit(new)
+            except StreamUnsupported:
+                stream_supported = False
+            except requests.RequestException:
+                pass
+            finally:
+                stream.close()
+
+        time.sleep(config.settings.refresh_interval)
+        try:
+            messages, _ = sync.sync(room, user_id)
+        except Exception as e:
+            print(f"Error updating messages: {e}", file=sys.stderr)
+            continue
+        for message in messages:
+            emit(message)
+
+
+def cmd_export(args) -> int:
+    from .history import export_history, iter_history
+
+    user_id = current_user()
+    room = resolve_room(args.room, user_id)
+    if args.output:
+        export_history(
+            room,
+            user_id,
+            args.output,
+            args.format,
+            args.concurrency,
+            resume=args.resume,
+        )
+        return 0
+
+    # Pages come newest first
+    for _, page in iter_history(room, user_id, concurrency=args.concurrency):
+        for message in page:
+            emit(message)
+    return 0
+
+
+def cmd_import(args) -> int:
+    from .history import import_history
+    from .store import store
+
+    room = resolve_room(args.room, current_user()) if args.room else None
+    emit({"imported": import_history(args.file, store, room)})
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="chat-terminal",
+        description="A terminal chat. Without a command, starts the chat UI.",
+    )
+    parser.add_argument("--profile", help="profile to log in and act as")
+    commands = parser.add_subparsers(dest="command")
+
+    login = commands.add_parser("login", help="log in with the browser")
+    login.set_defaults(func=cmd_login)
+
+    profiles = commands.add_parser("profiles", help="list profiles with a login")
+    profiles.set_defaults(func=cmd_profiles)
+
+    friends = commands.add_parser("friends", help="list friends and their rooms")
+    friends.set_defaults(func=cmd_friends)
+
+    send = commands.add_parser("send", help="send a message, or one per line of stdin")
+    send.add_argument("--room", help="chatroom id, or a friend's name or id")
+    send.add_argument("--json", action="store_true", help="stdin lines are JSON")
+    send.add_argument("--concurrency", type=int, default=1)
+    send.add_argument("message", nargs="*")
+    send.set_defaults(func=cmd_send)
+
+    tail = commands.add_parser("tail", help="print the latest messages of a room")
+    tail.add_argument("--room", required=True)
+    tail.add_argument("--limit", type=int, default=10)
+    tail.add_argument("-f", "--follow", action="store_true")
+    tail.set_defaults(func=cmd_tail)
+
+    export = commands.add_parser(
+        "export", help="print or save every message of a room, newest first"
+    )
+    export.add_argument("--room", required=True)
+    export.add_argument("-o", "--output", help="file to write, resumed if interrupted")
+    export.add_argument("--format", choices=["jsonl", "csv"])
+    export.add_argument("--concurrency", type=int, default=4)
+    export.add_argument("--no-resume", dest="resume", action="store_false")
+    export.set_defaults(func=cmd_export)
+
+    import_ = commands.add_parser(
+        "import", help="add an exported file to the local message cache"
+    )
+    import_.add_argument("file")
+    import_.add_argument("--room", help="room for every message, by default their own")
+    import_.set_defaults(func=cmd_import)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        from .config import config
+
+        config.set_profile(args.profile)
+    if args.command is None:
+        from .app import start
+
+        start()
+        return
+
+    try:
+        sys.exit(args.func(args))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import asyncio
+import contextvars
+import functools
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from .config import config
+from .metrics import metrics
+
+# Responses remembered for conditional requests, least recently used dropped
+RESPONSE_CACHE_SIZE = 256
+
+# Path segments holding ids, folded together so endpoints are timed as one
+ID_SEGMENT = re.compile(r"/[^/]*\d[^/]*")
+
+# Optional, a more compact and faster to decode alternative to JSON that the
+# server may answer with when asked for it
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ACCEPT = (
+    "application/msgpack, application/json;q=0.9" if msgpack else "application/json"
+)
+
+
+class ApiClient:
+    """Pooled keep-alive session shared by every call to the chat server."""
+
+    def __init__(self):
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> requests.Session:
+        settings = config.settings
+        # Only idempotent requests are retried after they reached the server,
+        # connection errors are retried for every method
+        retry = Retry(
+            total=settings.max_retries,
+            backoff_factor=settings.retry_backoff,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=settings.pool_size,
+            pool_maxsize=settings.pool_size,
+            max_retries=retry,
+        )
+
+        session = requests.Session()
+        # gzip and deflate, and brotli and zstd when their packages are installed
+        session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", config.settings.request_timeout)
+        if method == "GET":
+            return self._send(method, path, **kwargs)
+
+        # What is read after a write must not be an answer from before it, so
+        # reads started while it was on its way are not shared either
+        self._forget_flights()
+        try:
+            return self._send(method, path, **kwargs)
+        finally:
+            self._forget_flights()
+
+    def _forget_flights(self):
+        with self._flights_lock:
+            self._flights.clear()
+
+    def _send(self, method: str, path: str, **kwargs) -> requests.Response:
+        # Query strings may hold ids or personal data, like an email address
+        route = path.split("?", 1)[0]
+        endpoint = f"{method} {ID_SEGMENT.sub('/{id}', route)}"
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, f"{config.settings.server_url}{path}", **kwargs
+            )
+        except requests.RequestException:
+            metrics.count("request errors")
+            raise
+        finally:
+            metrics.record(endpoint, time.perf_counter() - start)
+            metrics.count("requests")
+
+        metrics.count(f"status {response.status_code}")
+        metrics.count("bytes sent", len(response.request.body or b""))
+        if not kwargs.get("stream"):
+            # A streamed body is read later, bit by bit
+            metrics.count("bytes received", len(response.content))
+            metrics.count("bytes on wire", response.raw.tell())
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def get_json(self, path: str, params: dict = None, **kwargs):
+        """GET ``path`` and decode its body, raising on any other status than 200.
+
+        The body is JSON, or MessagePack when msgpack is installed and the
+        server supports it.
+
+        Identical calls made while one is in flight, or within
+        ``request_coalesce_window`` seconds after it, share its answer instead
+        of making a request of their own, until the next write.
+
+        Responses carrying an ``ETag`` or ``Last-Modified`` header are kept, and
+        the next request for the same path and params is made conditional; a
+        304 answer then returns the body decoded the first time. Only its
+        top-level container is copied, what is nested in it is shared.
+        """
+        key = (path, _freeze(params), _freeze(kwargs.get("headers")))
+        with self._flights_lock:
+            # Each flight is shared until it expires, answered ones soon after
+            now = time.monotonic()
+            self._flights = {k: v for k, v in self._flights.items() if v[1] > now}
+            flight, _ = self._flights.get(key, (None, None))
+            leader = flight is None
+            if leader:
+                flight = Future()
+                self._flights[key] = (flight, float("inf"))
+
+        if not leader:
+            metrics.count("requests coalesced")
+            return _shallow_copy(flight.result())
+
+        try:
+            data = self._fetch_json(path, params, **kwargs)
+        except BaseException as e:
+            # Failures go to the calls waiting, later ones try again
+            with self._flights_lock:
+                if self._flights.get(key, (None,))[0] is flight:
+                    del self._flights[key]
+            flight.set_exception(e)
+            raise
+
+        with self._flights_lock:
+            if self._flights.get(key, (None,))[0] is flight:
+                expires = time.monotonic() + config.settings.request_coalesce_window
+                self._flights[key] = (flight, expires)
+        flight.set_result(data)
+        return _shallow_copy(data)
+
+    def _fetch_json(self, path: str, params: dict = None, **kwargs):
+        key = (path, _freeze(params))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.setdefault("Accept", ACCEPT)
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self.get(path, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            return cached["data"]
+        if response.status_code != 200:
+            raise requests.HTTPError(response.status_code, response=response)
+
+        data = decode(response)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        with self._cache_lock:
+            if etag or last_modified:
+                self._cache[key] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "data": data,
+                }
+                self._cache.move_to_end(key)
+                while len(self._cache) > RESPONSE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.pop(key, None)
+        return data
+
+    async def call(self, func, *args, **kwargs):
+        """Await a blocking API function without blocking the event loop.
+
+        Calls run on an executor sized like the connection pool, so as many
+        requests as there are pooled connections can be in flight at once, and
+        see the caller's profile.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=config.settings.pool_size,
+                        thread_name_prefix="api",
+                    )
+
+        # Run in a copy of the caller's context, so config.use_profile applies
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, func, *args, **kwargs)
+        )
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+        with self._cache_lock:
+            self._cache.clear()
+
+
+def decode(response: requests.Response):
+    if msgpack is not None and "msgpack" in response.headers.get("Content-Type", ""):
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+
+def _freeze(mapping: dict) -> tuple:
+    return tuple(sorted((mapping or {}).items()))
+
+
+def _shallow_copy(data):
+    if isinstance(data, (list, dict)):
+        return data.copy()
+    return data
+
+
+def is_undelivered(error: Exception) -> bool:
+    """Whether a failed request certainly was not acted on, so resending is safe.
+
+    A timeout or dropped connection after the request went out may still
+    have reached the server.
+    """
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status in (429, 503)
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        reason = error.args[0] if error.args else None
+        # Wrapped in a MaxRetryError when urllib3 gave up retrying
+        reason = getattr(reason, "reason", reason)
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+client = ApiClient()
@@ -1,90 +1,211 @@
 import textwrap
+import threading
 import tomllib
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-from pydantic import BaseModel
-from pydantic_settings import BaseSettings
-from textual import log
+from .log import log
 
+if TYPE_CHECKING:
+    from .models import AuthData, Settings
 
-class AuthData(BaseModel):
-    user_id: str
-    session_token: str
-    expires_at: Optional[int] = None
+DEFAULT_PROFILE = "default"
 
-
-class Settings(BaseSettings):
-    app_name: str = "chat-terminal"
-    server_url: str = "https://chat-server-cfpa.onrender.com"
-    refresh_interval: int = 1
-    max_messages: int = 50
-    time_format: str = "%H:%M:%S"
+# Profile of the code running in this context, set by AppConfig.use_profile
+_context_profile: ContextVar[Optional[str]] = ContextVar("profile", default=None)
 
 
 class AppConfig:
-    def __init__(self):
-        self.settings = Settings()
-        self.config_dir = Path.home() / ".config" / self.settings.app_name
-        self.auth_file = self.config_dir / "auth.json"
-        self.settings_file = self.config_dir / "settings.toml"
+    """Settings and saved login, read from the config directory on first use.
 
-        self.config_dir.mkdir(parents=True, exist_ok=True)
+    Nothing is imported, scanned or created until a setting or path is first
+    needed, so importing a module that uses the config stays cheap.
 
-        self._load_settings()
+    Settings are shared, logins belong to a profile. The default profile keeps
+    its login in the config directory, others in ``profiles/<name>/``.
+    """
 
-    def _load_settings(self):
-        if self.settings_file.exists():
+    def __init__(self):
+        self._settings = None
+        self._settings_lock = threading.Lock()
+        self._profile = None
+
+        # Each auth.json is parsed once and reloaded only when its mtime changes
+        self._auth: Dict[str, tuple] = {}
+        self._auth_lock = threading.Lock()
+
+    @property
+    def settings(self) -> "Settings":
+        if self._settings is None:
+            with self._settings_lock:
+                if self._settings is None:
+                    self._load()
+        return self._settings
+
+    @property
+    def config_dir(self) -> Path:
+        return Path.home() / ".config" / self.settings.app_name
+
+    @property
+    def profile(self) -> str:
+        """The profile whose login requests use, in this context."""
+        return _context_profile.get() or self._profile or self.settings.profile
+
+    def set_profile(self, profile: str):
+        self._profile = profile
+
+    @contextmanager
+    def use_profile(self, profile: Optional[str]):
+        """Use ``profile`` for what runs in the block, including ``client.call``."""
+        token = _context_profile.set(profile)
+        try:
+            yield
+        finally:
+            _context_profile.reset(token)
+
+    def profiles(self) -> List[str]:
+        """Profiles with a saved login, the default one first."""
+        profiles = (
+            [DEFAULT_PROFILE] if self.auth_file_of(DEFAULT_PROFILE).exists() else []
+        )
+        profiles_dir = self.config_dir / "profiles"
+        if profiles_dir.is_dir():
+            profiles += sorted(
+                path.parent.name for path in profiles_dir.glob("*/auth.json")
+            )
+        return profiles
+
+    def auth_file_of(self, profile: str) -> Path:
+        if profile == DEFAULT_PROFILE:
+            return self.config_dir / "auth.json"
+        return self.config_dir / "profiles" / profile / "auth.json"
+
+    @property
+    def auth_file(self) -> Path:
+        return self.auth_file_of(self.profile)
+
+    @property
+    def settings_file(self) -> Path:
+        return self.config_dir / "settings.toml"
+
+    def _load(self):
+        from .models import Settings
+
+        settings = Settings()
+        config_dir = Path.home() / ".config" / settings.app_name
+        config_dir.mkdir(parents=True, exist_ok=True)
+        self._load_settings(settings, config_dir / "settings.toml")
+        self._settings = settings
+
+    def _load_settings(self, settings: "Settings", settings_file: Path):
+        if settings_file.exists():
             try:
-                with open(self.settings_file, "rb") as f:
+                with open(settings_file, "rb") as f:
                     toml_settings = tomllib.load(f)
 
                 for key, value in toml_settings.items():
-                    if hasattr(self.settings, key):
-                        setattr(self.settings, key, value)
+                    if hasattr(settings, key):
+                        setattr(settings, key, value)
             except Exception as e:
                 log.error(f"Error loading settings: {e}")
         else:
-            self._create_default_settings()
+            self._create_default_settings(settings, settings_file)
 
-    def _create_default_settings(self):
+    def _create_default_settings(self, settings: "Settings", settings_file: Path):
         default_settings = textwrap.dedent(
             f"""
-            server_url = "{self.settings.server_url}"
-            refresh_interval = {self.settings.refresh_interval}
-            max_messages = {self.settings.max_messages}
-            time_format = "{self.settings.time_format}"
+            server_url = "{settings.server_url}"
+            profile = "{settings.profile}"
+            refresh_interval = {settings.refresh_interval}
+            poll_min_interval = {settings.poll_min_interval}
+            poll_max_interval = {settings.poll_max_interval}
+            poll_backoff = {settings.poll_backoff}
+            poll_jitter = {settings.poll_jitter}
+            pause_when_unfocused = {str(settings.pause_when_unfocused).lower()}
+            room_watch_interval = {settings.room_watch_interval}
+            max_messages = {settings.max_messages}
+            sync_page_size = {settings.sync_page_size}
+            max_cached_messages = {settings.max_cached_messages}
+            max_indexed_messages = {settings.max_indexed_messages}
+            max_rendered_messages = {settings.max_rendered_messages}
+            use_message_stream = {str(settings.use_message_stream).lower()}
+            stream_timeout = {settings.stream_timeout}
+            pool_size = {settings.pool_size}
+            request_timeout = {settings.request_timeout}
+            request_coalesce_window = {settings.request_coalesce_window}
+            max_retries = {settings.max_retries}
+            retry_backoff = {settings.retry_backoff}
+            auth_refresh_margin = {settings.auth_refresh_margin}
+            login_callback = {str(settings.login_callback).lower()}
+            time_format = "{settings.time_format}"
+            metrics_export = {str(settings.metrics_export).lower()}
+            metrics_export_interval = {settings.metrics_export_interval}
             """
         ).strip()
         try:
-            self.settings_file.write_text(default_settings)
+            settings_file.write_text(default_settings)
         except Exception as e:
             log.error(f"Error creating default settings: {e}")
 
-    def get_auth(self) -> Optional[AuthData]:
-        try:
-            if not self.auth_file.exists():
+    def get_auth(self) -> Optional["AuthData"]:
+        profile = self.profile
+        auth_file = self.auth_file_of(profile)
+        with self._auth_lock:
+            try:
+                mtime = auth_file.stat().st_mtime_ns
+            except OSError:
+                self._auth.pop(profile, None)
                 return None
-            data = self.auth_file.read_text()
-            return AuthData.parse_raw(data)
-        except Exception:
-            return None
+
+            auth, auth_mtime = self._auth.get(profile, (None, None))
+            if mtime != auth_mtime:
+                from .models import AuthData
+
+                try:
+                    auth = AuthData.parse_raw(auth_file.read_text())
+                except Exception:
+                    auth = None
+                self._auth[profile] = (auth, mtime)
+            return auth
 
     def save_auth(self, auth_data: dict) -> bool:
-        try:
-            auth = AuthData(**auth_data)
-            self.auth_file.write_text(auth.json())
-            return True
-        except Exception:
-            return False
+        profile = self.profile
+        auth_file = self.auth_file_of(profile)
+        with self._auth_lock:
+            from .models import AuthData
+
+            try:
+                auth = AuthData(**auth_data)
+                auth_file.parent.mkdir(parents=True, exist_ok=True)
+                auth_file.write_text(auth.json())
+                self._auth[profile] = (auth, auth_file.stat().st_mtime_ns)
+                return True
+            except Exception:
+                self._auth.pop(profile, None)
+                return False
 
     def clear_auth(self) -> bool:
-        try:
-            if self.auth_file.exists():
-                self.auth_file.unlink()
-            return True
-        except Exception:
-            return False
+        profile = self.profile
+        auth_file = self.auth_file_of(profile)
+        with self._auth_lock:
+            self._auth.pop(profile, None)
+            try:
+                if auth_file.exists():
+                    auth_file.unlink()
+                return True
+            except Exception:
+                return False
 
 
 config = AppConfig()
+
+
+def __getattr__(name: str):
+    # AuthData and Settings used to live here, they are imported on demand
+    if name in ("AuthData", "Settings"):
+        from . import models
+
+        return getattr(models, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,10 +1,10 @@
 from typing import Dict, List
 
 import requests
-from textual import log
 
 from .auth import get_auth
-from .config import config
+from .client import client
+from .log import log
 
 
 def fetch_friends(user_id: str) -> List[Dict]:
@@ -18,16 +18,11 @@ def fetch_friends(user_id: str) -> List[Dict]:
     headers = {"Authorization": f"Bearer {session_token}"}
 
     try:
-        response = requests.get(
-            f"{config.settings.server_url}/friends/",
+        friends = client.get_json(
+            "/friends/",
             params={"userId": user_id},
             headers=headers,
         )
-        if response.status_code == 200:
-            friends = response.json()
-        else:
-            log.error(f"Failed to get friends list: {response.status_code}")
-
     except Exception as e:
         log.error(f"Failed to get friends list: {e}")
 
@@ -45,16 +40,11 @@ def fetch_friend_requests(user_id: str) -> List[Dict]:
     headers = {"Authorization": f"Bearer {session_token}"}
 
     try:
-        response = requests.get(
-            f"{config.settings.server_url}/friends/requests",
+        friend_requests = client.get_json(
+            "/friends/requests",
             params={"userId": user_id},
             headers=headers,
         )
-        if response.status_code == 200:
-            friend_requests = response.json()
-        else:
-            log.error(f"Failed to get friend requests: {response.status_code}")
-
     except Exception as e:
         log.error(f"Failed to get friend requests: {e}")
 
@@ -70,8 +60,8 @@ def send_friend_request(friend_email: str) -> requests.Response:
     headers = {"Authorization": f"Bearer {session_token}"}
 
     try:
-        response = requests.post(
-            f"{config.settings.server_url}/friends/?friend_email={friend_email}",
+        response = client.post(
+            f"/friends/?friend_email={friend_email}",
             headers=headers,
         )
         return response
@@ -89,8 +79,8 @@ def accept_friend_request(friend_id: str) -> requests.Response:
     headers = {"Authorization": f"Bearer {session_token}"}
 
     try:
-        response = requests.post(
-            f"{config.settings.server_url}/friends/accept?friend_id={friend_id}",
+        response = client.post(
+            f"/friends/accept?friend_id={friend_id}",
             headers=headers,
         )
         return response
@@ -108,8 +98,8 @@ def reject_friend_request(friend_id: str) -> requests.Response:
     headers = {"Authorization": f"Bearer {session_token}"}
 
     try:
-        response = requests.post(
-            f"{config.settings.server_url}/friends/reject?friend_id={friend_id}",
+        response = client.post(
+            f"/friends/reject?friend_id={friend_id}",
             headers=headers,
         )
         return response
@@ -127,8 +117,8 @@ def delete_friend(friend_id: str) -> requests.Response:
     headers = {"Authorization": f"Bearer {session_token}"}
 
     try:
-        response = requests.post(
-            f"{config.settings.server_url}/friends/delete?friend_id={friend_id}",
+        response = client.post(
+            f"/friends/delete?friend_id={friend_id}",
             headers=headers,
         )
         return response
@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .chat import get_messages, message_key
+from .config import config
+from .log import log
+
+CSV_FIELDS = ["id", "chatroom_id", "sender_id", "sent_at", "content"]
+IMPORT_BATCH_SIZE = 500
+
+
+def iter_history(
+    chatroom_id: str,
+    user_id: str,
+    skip: int = 0,
+    concurrency: int = 4,
+    seen: Iterable[str] = (),
+) -> Iterator[Tuple[int, List[Dict]]]:
+    """Yield the pages of a room's history, newest first, with the skip after each.
+
+    Up to ``concurrency`` pages are fetched ahead, so only that many are held
+    in memory. Messages arriving meanwhile push older ones onto the next
+    page; those repeats, and messages whose key is in ``seen``, are dropped.
+    """
+    page_size = config.settings.max_messages
+    previous = set(seen)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        next_skip = skip
+        while True:
+            while len(pending) < concurrency:
+                pending.append(
+                    executor.submit(
+                        get_messages, chatroom_id, user_id, page_size, next_skip
+                    )
+                )
+                next_skip += page_size
+
+            page = pending.popleft().result()
+            skip += page_size
+            keys = {message_key(msg) for msg in page}
+            yield skip, [msg for msg in page if message_key(msg) not in previous]
+            previous = keys
+
+            if len(page) < page_size:
+                for future in pending:
+                    future.cancel()
+                return
+
+
+def export_history(
+    chatroom_id: str,
+    user_id: str,
+    path: Path,
+    format: str = None,
+    concurrency: int = 4,
+    resume: bool = True,
+) -> int:
+    """Write a room's history to ``path`` as JSON lines or CSV, newest first.
+
+    Progress is kept next to the file in ``<path>.progress`` until the export
+    completes, and an interrupted export continues where it stopped.
+    Returns the number of messages written by this call.
+    """
+    path = Path(path)
+    format = format or ("csv" if path.suffix == ".csv" else "jsonl")
+    progress_file = path.with_name(path.name + ".progress")
+
+    progress = _load_progress(progress_file) if resume else None
+    if progress and progress["chatroom_id"] != chatroom_id:
+        progress = None
+
+    skip, seen = 0, []
+    if progress and path.exists():
+        # Messages sent since the export started shift every page down
+        skip = progress["skip"] + _count_newer(chatroom_id, user_id, progress)
+        seen = progress["keys"]
+        mode = "a"
+    else:
+        progress = {"chatroom_id": chatroom_id, "newest": None}
+        mode = "w"
+
+    written = 0
+    with open(path, mode, newline="") as f:
+        if format == "csv":
+            writer = csv.DictWriter(f, CSV_FIELDS, extrasaction="ignore")
+            if mode == "w":
+                writer.writeheader()
+            write = writer.writerow
+        else:
+
+            def write(message: Dict):
+                f.write(json.dumps(message) + "\n")
+
+        for skip, page in iter_history(chatroom_id, user_id, skip, concurrency, seen):
+            if page and progress["newest"] is None:
+                progress["newest"] = {"sent_at": page[0]["sent_at"]}
+            for message in page:
+                write(message)
+            written += len(page)
+
+            f.flush()
+            progress["skip"] = skip
+            progress["keys"] = [message_key(msg) for msg in page]
+            _save_progress(progress_file, progress)
+
+    progress_file.unlink(missing_ok=True)
+    return written
+
+
+def import_history(path: Path, store, chatroom_id: str = None) -> int:
+    """Add the messages of an exported file to ``store``, returning how many.
+
+    Messages keep the room they were exported from unless ``chatroom_id`` is
+    given. The file is read in batches, never whole.
+    """
+    path = Path(path)
+    imported = 0
+    for batch in _batches(_read_messages(path), IMPORT_BATCH_SIZE):
+        rooms: Dict[str, List[Dict]] = {}
+        for message in batch:
+            room = chatroom_id or message.get("chatroom_id")
+            if not room:
+                log.warning(f"Skipping message without a chatroom: {message}")
+                continue
+            rooms.setdefault(room, []).append(message)
+        for room, messages in rooms.items():
+            store.add(room, messages)
+            imported += len(messages)
+    return imported
+
+
+def _read_messages(path: Path) -> Iterator[Dict]:
+    with open(path, newline="") as f:
+        if path.suffix == ".csv":
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _batches(items: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _count_newer(chatroom_id: str, user_id: str, progress: Dict) -> int:
+    newest = progress.get("newest")
+    if not newest:
+        return 0
+
+    page_size = config.settings.max_messages
+    count, skip = 0, 0
+    while True:
+        page = get_messages(
+            chatroom_id, user_id, page_size, skip, since=newest["sent_at"]
+        )
+        count += sum(1 for msg in page if msg["sent_at"] > newest["sent_at"])
+        if len(page) < page_size:
+            return count
+        skip += page_size
+
+
+def _load_progress(progress_file: Path) -> Optional[Dict]:
+    try:
+        return json.loads(progress_file.read_text())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.error(f"Error reading export progress: {e}")
+        return None
+
+
+def _save_progress(progress_file: Path, progress: Dict):
+    # Replaced in one step, so an interruption never leaves half a file
+    temp_file = progress_file.with_name(progress_file.name + ".tmp")
+    temp_file.write_text(json.dumps(progress))
+    os.replace(temp_file, progress_file)
@@ -0,0 +1,24 @@
+import logging
+import sys
+
+
+class Log:
+    """``textual.log`` while the UI is running, the logging module otherwise.
+
+    Lets modules shared with the command line log without importing Textual.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger("chat-terminal")
+
+    def __call__(self, *args, **kwargs):
+        self.info(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        textual = sys.modules.get("textual")
+        if textual is not None:
+            return getattr(textual.log, name)
+        return getattr(self._logger, name)
+
+
+log = Log()
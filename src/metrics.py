@@ -0,0 +1,89 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+from .config import config
+from .log import log
+
+# Samples kept per timing, older ones no longer count towards percentiles
+MAX_SAMPLES = 1000
+
+
+class Metrics:
+    """Timings and counters collected while the app runs.
+
+    Timings are kept in seconds under a name such as ``GET /friends/``, and
+    reported as percentiles over their most recent ``MAX_SAMPLES`` samples.
+    """
+
+    def __init__(self):
+        self._timings: Dict[str, deque] = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._timings[name].append(seconds)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+            self._started = time.time()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            timings = {name: sorted(samples) for name, samples in self._timings.items()}
+            counters = dict(self._counters)
+
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self._started,
+            "timings": {
+                name: {
+                    "count": len(samples),
+                    "p50": _percentile(samples, 50),
+                    "p95": _percentile(samples, 95),
+                    "p99": _percentile(samples, 99),
+                }
+                for name, samples in timings.items()
+                if samples
+            },
+            "counters": counters,
+        }
+
+    def export(self, path: Optional[Path] = None):
+        """Append a snapshot as one JSON line, to metrics.jsonl by default."""
+        path = path or config.config_dir / "metrics.jsonl"
+        try:
+            with open(path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+        except Exception as e:
+            log.error(f"Error exporting metrics: {e}")
+
+
+def _percentile(samples: list, percent: float) -> float:
+    # Nearest rank on samples that are already sorted
+    index = max(0, math.ceil(percent / 100 * len(samples)) - 1)
+    return samples[index]
+
+
+metrics = Metrics()
@@ -0,0 +1,47 @@
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings
+
+
+class AuthData(BaseModel):
+    user_id: str
+    session_token: str
+    expires_at: Optional[int] = None
+
+    def expires_within(self, seconds: int) -> bool:
+        return self.expires_at is not None and self.expires_at - time.time() <= seconds
+
+    def is_expired(self) -> bool:
+        return self.expires_within(0)
+
+
+class Settings(BaseSettings):
+    app_name: str = "chat-terminal"
+    server_url: str = "https://chat-server-cfpa.onrender.com"
+    profile: str = "default"
+    refresh_interval: int = 1
+    poll_min_interval: float = 0.5
+    poll_max_interval: float = 30
+    poll_backoff: float = 1.5
+    poll_jitter: float = 0.1
+    pause_when_unfocused: bool = True
+    room_watch_interval: float = 5
+    max_messages: int = 50
+    sync_page_size: int = 10
+    max_cached_messages: int = 1000
+    max_indexed_messages: int = 20000
+    max_rendered_messages: int = 500
+    use_message_stream: bool = True
+    stream_timeout: int = 30
+    pool_size: int = 10
+    request_timeout: float = 10
+    request_coalesce_window: float = 0.2
+    max_retries: int = 3
+    retry_backoff: float = 0.5
+    auth_refresh_margin: int = 300
+    login_callback: bool = True
+    time_format: str = "%H:%M:%S"
+    metrics_export: bool = False
+    metrics_export_interval: float = 10
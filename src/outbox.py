@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .config import config
+from .log import log
+
+
+class Outbox:
+    """Messages typed but not yet accepted by the server, kept across restarts."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self._messages = None
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self) -> List[Dict]:
+        if self._messages is None:
+            self._messages = self._load()
+        return self._messages
+
+    def add(self, chatroom_id: str, sender_id: str, content: str) -> Dict:
+        message = {
+            "id": f"local-{uuid.uuid4().hex}",
+            "chatroom_id": chatroom_id,
+            "sender_id": sender_id,
+            "content": content,
+            "sent_at": datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+            "status": "pending",
+        }
+        with self._lock:
+            self.messages.append(message)
+            self._save()
+        return message
+
+    def remove(self, message_id: str):
+        with self._lock:
+            self._messages = [msg for msg in self.messages if msg["id"] != message_id]
+            self._save()
+
+    def next(self) -> Optional[Dict]:
+        with self._lock:
+            return self.messages[0] if self.messages else None
+
+    def pending_for(self, chatroom_id: str = None) -> List[Dict]:
+        with self._lock:
+            return [
+                msg
+                for msg in self.messages
+                if chatroom_id is None or msg["chatroom_id"] == chatroom_id
+            ]
+
+    def _file(self) -> Path:
+        return self.path or config.config_dir / "outbox.json"
+
+    def _load(self) -> List[Dict]:
+        try:
+            if not self._file().exists():
+                return []
+            return json.loads(self._file().read_text())
+        except Exception as e:
+            log.error(f"Error loading outbox: {e}")
+            return []
+
+    def _save(self):
+        # Replaced in one step, so a crash never leaves a truncated outbox
+        file = self._file()
+        temp_file = file.with_name(file.name + ".tmp")
+        try:
+            temp_file.write_text(json.dumps(self._messages))
+            os.replace(temp_file, file)
+        except Exception as e:
+            log.error(f"Error saving outbox: {e}")
+
+
+outbox = Outbox()
@@ -0,0 +1,94 @@
+import asyncio
+import random
+import time
+
+from .config import config
+from .metrics import metrics
+
+
+class PollScheduler:
+    """Adaptive delay between polls.
+
+    Polls start every ``refresh_interval`` seconds, or ``base_interval`` when
+    given. New activity drops the delay to ``poll_min_interval`` (or
+    ``min_interval``), every idle or failed poll multiplies it by
+    ``poll_backoff`` up to ``poll_max_interval``, and each delay is spread by
+    ``poll_jitter`` so many clients do not poll in lockstep. While paused,
+    e.g. when the terminal loses focus, no poll is due at all.
+
+    How late each wait returns past its delay is recorded as ``<name> lag``.
+    """
+
+    def __init__(
+        self,
+        base_interval: float = None,
+        min_interval: float = None,
+        name: str = "poll",
+    ):
+        self.name = name
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.interval = self._base()
+        self.failures = 0
+        self._wake = asyncio.Event()
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+    def reset(self):
+        self.interval = self._base()
+        self.failures = 0
+
+    def activity(self):
+        self.interval = self._min()
+        self.failures = 0
+
+    def idle(self):
+        self.failures = 0
+        self._back_off()
+
+    def failure(self):
+        self.failures += 1
+        self._back_off()
+
+    def wake(self):
+        """Make the pending wait return now."""
+        self._wake.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        if not self._resumed.is_set():
+            self._resumed.set()
+            self.wake()
+
+    def next_delay(self) -> float:
+        jitter = config.settings.poll_jitter
+        return self.interval * random.uniform(1 - jitter, 1 + jitter)
+
+    async def wait(self):
+        delay = self.next_delay()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            metrics.record(f"{self.name} lag", time.perf_counter() - start - delay)
+        await self._resumed.wait()
+        # Also the wake of resuming, it ended this wait and not the next one
+        self._wake.clear()
+
+    def _base(self) -> float:
+        if self.base_interval is None:
+            return config.settings.refresh_interval
+        return self.base_interval
+
+    def _min(self) -> float:
+        if self.min_interval is None:
+            return config.settings.poll_min_interval
+        return self.min_interval
+
+    def _back_off(self):
+        self.interval = min(
+            max(self.interval, self._min()) * config.settings.poll_backoff,
+            config.settings.poll_max_interval,
+        )
@@ -0,0 +1,230 @@
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .chat import message_key
+from .config import config
+from .log import log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    chatroom_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    sent_at TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (chatroom_id, key)
+);
+CREATE INDEX IF NOT EXISTS messages_chatroom_sent_at
+    ON messages (chatroom_id, sent_at);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    chatroom_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    sent_at TEXT NOT NULL,
+    sender_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    UNIQUE (chatroom_id, key)
+);
+CREATE INDEX IF NOT EXISTS history_chatroom_sent_at
+    ON history (chatroom_id, sent_at);
+"""
+
+# Trigram tokens match any substring, also in text without spaces between words
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    content, content='history', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS history_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS history_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+END;
+"""
+SEARCH_LIMIT = 50
+SEARCH_COLUMNS = "h.key, h.chatroom_id, h.sender_id, h.sent_at, h.content"
+LIKE_SPECIAL = re.compile(r"[%_\\]")
+
+
+class MessageStore:
+    """On-disk cache of chat messages, keyed by chatroom.
+
+    Each chatroom keeps at most ``max_cached_messages`` of its newest messages,
+    older ones are evicted as new ones are added. Messages added are also kept
+    in a search index, up to ``max_indexed_messages`` per chatroom.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._fts = False
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.path or config.config_dir / "messages.db"
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            created = not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'history'"
+            ).fetchone()
+            conn.executescript(SCHEMA)
+            try:
+                conn.executescript(SEARCH_SCHEMA)
+                self._fts = True
+            except sqlite3.OperationalError as e:
+                # Without FTS5 or its trigram tokenizer, search scans instead
+                log.warning(f"Full-text search unavailable: {e}")
+            if created:
+                # Index what was cached before search existed
+                with conn:
+                    conn.execute(
+                        """
+                        INSERT OR IGNORE INTO history
+                            (chatroom_id, key, sent_at, sender_id, content)
+                        SELECT chatroom_id, key, sent_at,
+                            coalesce(json_extract(data, '$.sender_id'), ''),
+                            coalesce(json_extract(data, '$.content'), '')
+                        FROM messages
+                        """
+                    )
+            self._conn = conn
+        return self._conn
+
+    def add(self, chatroom_id: str, messages: List[Dict]):
+        if not messages:
+            return
+
+        rows = [
+            (chatroom_id, message_key(msg), msg["sent_at"], json.dumps(msg))
+            for msg in messages
+        ]
+        try:
+            with self._lock, self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)", rows
+                )
+                self.conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO history
+                        (chatroom_id, key, sent_at, sender_id, content)
+                    VALUES (?, ?, ?, coalesce(json_extract(?4, '$.sender_id'), ''),
+                        coalesce(json_extract(?4, '$.content'), ''))
+                    """,
+                    rows,
+                )
+                self.conn.execute(
+                    """
+                    DELETE FROM history WHERE id IN (
+                        SELECT id FROM history WHERE chatroom_id = ?
+                        ORDER BY sent_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (chatroom_id, config.settings.max_indexed_messages),
+                )
+                self.conn.execute(
+                    """
+                    DELETE FROM messages WHERE chatroom_id = ? AND key IN (
+                        SELECT key FROM messages WHERE chatroom_id = ?
+                        ORDER BY sent_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (chatroom_id, chatroom_id, config.settings.max_cached_messages),
+                )
+        except sqlite3.Error as e:
+            log.error(f"Failed to cache messages: {e}")
+
+    def recent(self, chatroom_id: str, limit: int = None) -> List[Dict]:
+        """Return the newest ``limit`` cached messages, oldest first."""
+        if limit is None:
+            limit = config.settings.max_messages
+
+        try:
+            with self._lock:
+                rows = self.conn.execute(
+                    """
+                    SELECT data FROM messages WHERE chatroom_id = ?
+                    ORDER BY sent_at DESC LIMIT ?
+                    """,
+                    (chatroom_id, limit),
+                ).fetchall()
+        except sqlite3.Error as e:
+            log.error(f"Failed to read cached messages: {e}")
+            return []
+
+        return [json.loads(data) for (data,) in reversed(rows)]
+
+    def search(
+        self, query: str, chatroom_id: str = None, limit: int = SEARCH_LIMIT
+    ) -> List[Dict]:
+        """Return messages containing every word of ``query``, best match first.
+
+        Results carry the chatroom, sender, time and content of each message,
+        with its cache key as ``id``.
+        """
+        terms = query.split()
+        if not terms:
+            return []
+
+        room = "AND h.chatroom_id = ?" if chatroom_id else ""
+        if self._fts and all(len(term) >= 3 for term in terms):
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            sql = f"""
+                SELECT {SEARCH_COLUMNS} FROM history_fts JOIN history h
+                    ON h.id = history_fts.rowid
+                WHERE history_fts MATCH ? {room}
+                ORDER BY history_fts.rank, h.sent_at DESC LIMIT ?
+            """
+            params = [match]
+        else:
+            # Trigrams cannot match words shorter than three characters
+            like = " AND ".join(["h.content LIKE ? ESCAPE '\\'"] * len(terms))
+            sql = f"""
+                SELECT {SEARCH_COLUMNS} FROM history h WHERE {like} {room}
+                ORDER BY h.sent_at DESC LIMIT ?
+            """
+            params = ["%" + LIKE_SPECIAL.sub(r"\\\g<0>", term) + "%" for term in terms]
+        params += [chatroom_id] if chatroom_id else []
+        params.append(limit)
+
+        try:
+            with self._lock:
+                rows = self.conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            log.error(f"Failed to search messages: {e}")
+            return []
+
+        return [
+            dict(zip(("id", "chatroom_id", "sender_id", "sent_at", "content"), row))
+            for row in rows
+        ]
+
+    def clear(self, chatroom_id: str = None):
+        try:
+            with self._lock, self.conn:
+                if chatroom_id is None:
+                    self.conn.execute("DELETE FROM messages")
+                    self.conn.execute("DELETE FROM history")
+                else:
+                    self.conn.execute(
+                        "DELETE FROM messages WHERE chatroom_id = ?", (chatroom_id,)
+                    )
+                    self.conn.execute(
+                        "DELETE FROM history WHERE chatroom_id = ?", (chatroom_id,)
+                    )
+        except sqlite3.Error as e:
+            log.error(f"Failed to clear cached messages: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+store = MessageStore()
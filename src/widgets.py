@@ -0,0 +1,288 @@
+import re
+from bisect import bisect_right
+from typing import Any, Callable, Dict, List, Optional
+
+from rich.errors import MarkupError
+from rich.segment import Segment
+from rich.text import Text
+from textual import events
+from textual.cache import LRUCache
+from textual.geometry import Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.widgets import ListItem, ListView, Static
+
+from .chat import format_message, message_key
+from .metrics import metrics
+
+# Escaped in widget ids, "-" included since it joins the parts of an id
+UNSAFE_ID_CHARS = re.compile(r"[^A-Za-z0-9]")
+
+
+class MessageView(ScrollView, can_focus=True):
+    """Chat log holding messages as records and rendering only visible rows.
+
+    Messages are wrapped to the widget width once, when they are added or the
+    width changes; turning them into strips is left to ``render_line`` and
+    cached, so a refresh only touches the rows that are on screen.
+    """
+
+    def __init__(self, *, id: str = None, classes: str = None):
+        super().__init__(id=id, classes=classes)
+        self.user_id = None
+        self.messages: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+        self._heights: List[int] = []
+        # _offsets[i] is the first line of message i, _offsets[-1] the total
+        self._offsets: List[int] = [0]
+        self._wrap_width = 0
+        self._line_cache: LRUCache[tuple, List[Strip]] = LRUCache(1024)
+
+    @property
+    def line_count(self) -> int:
+        return self._offsets[-1]
+
+    def clear(self):
+        self.messages = []
+        self._positions = {}
+        self._heights = []
+        self._offsets = [0]
+        self._line_cache.clear()
+        self._update_virtual_size()
+        self.refresh()
+
+    def set_messages(self, messages: List[Dict]):
+        self.clear()
+        self.append(messages)
+        self.scroll_end(animate=False, immediate=False, x_axis=False)
+
+    def append(self, messages: List[Dict]):
+        if not messages:
+            return
+
+        at_end = self.is_vertical_scroll_end
+        first_line = self.line_count
+        for message in messages:
+            self._positions[message_key(message)] = len(self.messages)
+            self.messages.append(message)
+            height = self._measure(message)
+            self._heights.append(height)
+            self._offsets.append(self._offsets[-1] + height)
+        self._update_virtual_size()
+
+        if at_end:
+            self.scroll_end(animate=False, immediate=False, x_axis=False)
+        elif first_line < self.scroll_offset.y + self.size.height:
+            self.refresh_lines(first_line, self.line_count - first_line)
+
+    def prepend(self, messages: List[Dict]):
+        """Insert older messages above, keeping the rows in view where they are."""
+        if not messages:
+            return
+
+        heights = [self._measure(message) for message in messages]
+        self.messages[:0] = messages
+        self._heights[:0] = heights
+        self._reindex()
+        self.set_scroll(None, self.scroll_offset.y + sum(heights))
+        self.refresh()
+
+    def update(self, message: Dict, key: Optional[str] = None) -> bool:
+        """Replace the message stored under ``key`` (by default its own key)."""
+        if key is None:
+            key = message_key(message)
+        index = self._positions.get(key)
+        if index is None:
+            return False
+
+        self.messages[index] = message
+        new_key = message_key(message)
+        if new_key != key:
+            del self._positions[key]
+            self._positions[new_key] = index
+        self._line_cache.discard((key, self._wrap_width))
+        self._line_cache.discard((new_key, self._wrap_width))
+
+        height = self._measure(message)
+        if height == self._heights[index]:
+            self.refresh_lines(self._offsets[index], height)
+        else:
+            self._heights[index] = height
+            self._reindex()
+            self.refresh()
+        return True
+
+    def drop_oldest(self, count: int):
+        if count <= 0:
+            return
+
+        removed = self._offsets[min(count, len(self.messages))]
+        del self.messages[:count]
+        del self._heights[:count]
+        self._reindex()
+        self.set_scroll(None, max(0, self.scroll_offset.y - removed))
+        self.refresh()
+
+    def drop_newest(self, count: int):
+        if count <= 0:
+            return
+
+        del self.messages[-count:]
+        del self._heights[-count:]
+        self._reindex()
+        self.refresh()
+
+    def on_resize(self, event: events.Resize) -> None:
+        width = self.scrollable_content_region.width
+        if width == self._wrap_width:
+            return
+
+        # Re-wrap everything, keeping the message at the top of the view in place
+        at_end = self.is_vertical_scroll_end
+        top = bisect_right(self._offsets, self.scroll_offset.y) - 1
+        self._wrap_width = width
+        self._line_cache.clear()
+        self._heights = [self._measure(message) for message in self.messages]
+        self._reindex()
+
+        if at_end:
+            self.scroll_end(animate=False, immediate=False, x_axis=False)
+        elif 0 <= top < len(self.messages):
+            self.set_scroll(None, self._offsets[top])
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        width = self.scrollable_content_region.width
+        line_y = scroll_y + y
+        if line_y >= self.line_count:
+            return Strip.blank(width, self.rich_style)
+
+        index = bisect_right(self._offsets, line_y) - 1
+        lines = self._render_message(index)
+        row = line_y - self._offsets[index]
+        strip = lines[row] if row < len(lines) else Strip.blank(width)
+        strip = strip.crop_extend(scroll_x, scroll_x + width, self.rich_style)
+        return strip.apply_style(self.rich_style)
+
+    def _reindex(self):
+        # Positions and offsets follow messages and _heights after they change
+        self._positions = {
+            message_key(message): index for index, message in enumerate(self.messages)
+        }
+        self._offsets = [0]
+        for height in self._heights:
+            self._offsets.append(self._offsets[-1] + height)
+        self._update_virtual_size()
+
+    def _update_virtual_size(self):
+        self.virtual_size = Size(self._wrap_width, self.line_count)
+
+    def _text(self, message: Dict) -> Text:
+        markup = format_message(message, self.user_id)
+        try:
+            return Text.from_markup(markup)
+        except MarkupError:
+            return Text(markup)
+
+    def _measure(self, message: Dict) -> int:
+        if self._wrap_width <= 0:
+            return 1
+
+        text = self._text(message)
+        if text.cell_len <= self._wrap_width and "\n" not in text.plain:
+            return 1
+
+        lines = self._render_lines(text)
+        self._line_cache.set((message_key(message), self._wrap_width), lines)
+        return len(lines)
+
+    def _render_message(self, index: int) -> List[Strip]:
+        message = self.messages[index]
+        cache_key = (message_key(message), self._wrap_width)
+        lines = self._line_cache.get(cache_key)
+        if lines is None:
+            lines = self._render_lines(self._text(message))
+            self._line_cache.set(cache_key, lines)
+        return lines
+
+    def _render_lines(self, text: Text) -> List[Strip]:
+        width = max(self._wrap_width, 1)
+        console = self.app.console
+        options = console.options.update_width(width)
+        lines = Segment.split_lines(console.render(text, options))
+        return [Strip(line).adjust_cell_length(width) for line in lines]
+
+
+class MetricsPanel(Static):
+    """Request timings, counters and render times, refreshed while shown."""
+
+    def on_mount(self) -> None:
+        self.set_interval(1, self.refresh_metrics)
+
+    def refresh_metrics(self):
+        if not self.display:
+            return
+
+        snapshot = metrics.snapshot()
+        lines = ["p50 / p95 / p99 ms"]
+        for name, timing in sorted(snapshot["timings"].items()):
+            lines.append(name)
+            lines.append(
+                f"  {timing['p50'] * 1000:.1f} / {timing['p95'] * 1000:.1f}"
+                f" / {timing['p99'] * 1000:.1f}  ({timing['count']})"
+            )
+        lines.append("")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name}: {value}")
+        self.update(Text("\n".join(lines)))
+
+
+def list_item_id(prefix: str, *keys: Any) -> str:
+    """A widget id for the list row showing ``keys``, stable across updates.
+
+    Other characters than ASCII letters and digits become ``_`` and the hex
+    of their UTF-8 bytes, so different keys never share an id.
+    """
+    escaped = [UNSAFE_ID_CHARS.sub(_escape_id_char, str(key)) for key in keys]
+    return "-".join([prefix, *escaped])
+
+
+def _escape_id_char(match: re.Match) -> str:
+    return "".join(f"_{byte:02x}" for byte in match.group().encode())
+
+
+async def reconcile_list_view(
+    list_view: ListView,
+    rows: Dict[str, Any],
+    create: Callable[[str, Any], ListItem],
+    update: Callable[[ListItem, Any], None],
+):
+    """Make ``list_view`` show ``rows``, an ordered mapping of item id to data.
+
+    Rows already on screen are updated in place and moved when their position
+    changed, only new rows are mounted and only rows that went away removed.
+    """
+    highlighted = list_view.highlighted_child
+    stale = [item for item in list_view.children if item.id not in rows]
+    if stale:
+        await list_view.remove_children(stale)
+
+    existing = {item.id: item for item in list_view.children}
+    mounts = []
+    for index, (item_id, data) in enumerate(rows.items()):
+        item = existing.get(item_id)
+        if item is None:
+            before = index if index < len(list_view.children) else None
+            mounts.append(list_view.mount(create(item_id, data), before=before))
+            continue
+        update(item, data)
+        if list_view.children[index] is not item:
+            list_view.move_child(item, before=index)
+    for mount in mounts:
+        await mount
+
+    # The highlight follows the row, not its old position
+    if highlighted is not None and highlighted in list_view.children:
+        list_view.index = list_view.children.index(highlighted)
+    else:
+        list_view.index = list_view.index
@@ -0,0 +1,25 @@
+import pytest
+
+from benchmarks.mock_server import USER_ID, MockChatServer
+from src.client import client
+from src.config import config
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    # Keeps logins and caches written by the code under test out of ~/.config
+    monkeypatch.setenv("HOME", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = MockChatServer(friends=1).start()
+    monkeypatch.setattr(config.settings, "server_url", server.url)
+    # Requests repeated right after a change must see it
+    monkeypatch.setattr(config.settings, "request_coalesce_window", 0)
+    config.save_auth({"user_id": USER_ID, "session_token": "test-token"})
+    yield server
+    server.stop()
+    # Drops pooled connections and remembered responses of this server
+    client.close()
@@ -0,0 +1,177 @@
+import asyncio
+import io
+import json
+
+import pytest
+import requests
+
+from benchmarks.mock_server import USER_ID
+from src.chat import MessageStream, MessageSync, StreamUnsupported
+from src.client import client
+from src.config import config
+
+ROOM = "room0"
+FRIEND = "friend0"
+
+
+def event_stream(body: str) -> MessageStream:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/event-stream"
+    response.raw = io.BytesIO(body.encode())
+    stream = MessageStream(ROOM, USER_ID)
+    stream.response = response
+    return stream
+
+
+def message(content: str, sent_at: str = "2025-01-01T00:00:00", **fields) -> dict:
+    return {"sender_id": FRIEND, "content": content, "sent_at": sent_at, **fields}
+
+
+def test_stream_unsupported_on_404(monkeypatch, server):
+    monkeypatch.setattr(server, "stream", False)
+
+    with pytest.raises(StreamUnsupported):
+        MessageStream(ROOM, USER_ID).open()
+
+
+def test_stream_unsupported_without_event_stream(monkeypatch, server):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response.raw = io.BytesIO(b"{}")
+    monkeypatch.setattr(client, "get", lambda *args, **kwargs: response)
+
+    with pytest.raises(StreamUnsupported):
+        MessageStream(ROOM, USER_ID).open()
+
+
+def test_stream_delivers_new_messages(monkeypatch, server):
+    # Fails on the first heartbeat's wait instead of hanging
+    monkeypatch.setattr(config.settings, "stream_timeout", 2)
+    stream = MessageStream(ROOM, USER_ID)
+    stream.open()
+    try:
+        sent = server.add_message(ROOM, FRIEND, "hello")
+        assert next(iter(stream)) == sent
+    finally:
+        stream.close()
+
+
+def test_stream_closed_when_consumer_stops(server):
+    stream = MessageStream(ROOM, USER_ID)
+    stream.open()
+
+    async def consume():
+        task = asyncio.ensure_future(anext(aiter(stream)))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(consume())
+    # Heartbeats alone would keep the reading thread waiting
+    assert stream.response.raw.closed
+
+
+def test_stream_parses_events():
+    first = message("one", id="1")
+    batch = [message("two", id="2"), message("three", id="3")]
+    multiline = json.dumps(message("four", id="4"), indent=1).splitlines()
+    body = (
+        ": connected\n\n"
+        f"event: message\nid: 1\ndata: {json.dumps(first)}\n\n"
+        f"data: {json.dumps({'messages': batch})}\n\n"
+        + "".join(f"data: {line}\n" for line in multiline)
+        + "\n"
+        f"data: {json.dumps(message('你好'), ensure_ascii=False)}\n\n"
+    )
+
+    contents = [msg["content"] for msg in event_stream(body)]
+
+    assert contents == ["one", "two", "three", "four", "你好"]
+
+
+def test_stream_drops_invalid_events():
+    body = (
+        "data: not json\n\n"
+        "data: [1, 2]\n\n"
+        'data: {"content": "no time"}\n\n'
+        f"data: {json.dumps({'messages': [message('kept'), {'content': 'x'}]})}\n\n"
+        'data: {"status": "typing"}\n\n'
+    )
+
+    assert [msg["content"] for msg in event_stream(body)] == ["kept"]
+
+
+def test_sync_first_replaces_then_returns_delta(server):
+    sync = MessageSync()
+    server.add_message(ROOM, FRIEND, "old")
+
+    messages, replace = sync.sync(ROOM, USER_ID)
+    assert [msg["content"] for msg in messages] == ["old"]
+    assert replace
+
+    server.add_message(ROOM, FRIEND, "new 1")
+    server.add_message(ROOM, USER_ID, "new 2")
+    messages, replace = sync.sync(ROOM, USER_ID)
+    assert [msg["content"] for msg in messages] == ["new 1", "new 2"]
+    assert not replace
+
+    assert sync.sync(ROOM, USER_ID) == ([], False)
+
+
+def test_sync_pages_through_delta(monkeypatch, server):
+    monkeypatch.setattr(config.settings, "sync_page_size", 2)
+    sync = MessageSync()
+    server.add_message(ROOM, FRIEND, "old")
+    sync.sync(ROOM, USER_ID)
+
+    for i in range(5):
+        server.add_message(ROOM, FRIEND, f"new {i}")
+    messages, replace = sync.sync(ROOM, USER_ID)
+
+    assert [msg["content"] for msg in messages] == [f"new {i}" for i in range(5)]
+    assert not replace
+
+
+def test_sync_replaces_when_delta_fills_window(monkeypatch, server):
+    monkeypatch.setattr(config.settings, "sync_page_size", 2)
+    monkeypatch.setattr(config.settings, "max_messages", 4)
+    sync = MessageSync()
+    server.add_message(ROOM, FRIEND, "old")
+    sync.sync(ROOM, USER_ID)
+
+    for i in range(6):
+        server.add_message(ROOM, FRIEND, f"new {i}")
+    messages, replace = sync.sync(ROOM, USER_ID)
+
+    assert replace
+    assert "old" not in [msg["content"] for msg in messages]
+
+
+def test_push_skips_seen_messages():
+    sync = MessageSync()
+    first = message("one", id="1")
+    same_time = message("two", id="2")
+    later = message("three", sent_at="2025-01-01T00:00:01", id="3")
+
+    assert sync.push(ROOM, [first]) == [first]
+    assert sync.push(ROOM, [first]) == []
+    # Same timestamp, told apart by key
+    assert sync.push(ROOM, [same_time]) == [same_time]
+    assert sync.push(ROOM, [first, same_time]) == []
+    assert sync.push(ROOM, [later]) == [later]
+    assert sync.push(ROOM, [same_time]) == []
+
+
+def test_sync_after_push_fetches_only_unseen(server):
+    sync = MessageSync()
+    sync.sync(ROOM, USER_ID)
+    pushed = server.add_message(ROOM, FRIEND, "streamed")
+    sync.push(ROOM, [pushed])
+
+    assert sync.sync(ROOM, USER_ID) == ([], False)
+    server.add_message(ROOM, FRIEND, "polled")
+    messages, _ = sync.sync(ROOM, USER_ID)
+    assert [msg["content"] for msg in messages] == ["polled"]
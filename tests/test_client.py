@@ -0,0 +1,204 @@
+import socket
+import threading
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from benchmarks.mock_server import USER_ID
+from src import client as client_module
+from src.chat import post_message
+from src.client import client, is_undelivered
+from src.config import config
+
+MESSAGES = "/chat/chatrooms/room0/messages"
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Headers and status of every request made, in order."""
+    sent = []
+    send = client._send
+
+    def record(method, path, **kwargs):
+        response = send(method, path, **kwargs)
+        sent.append((method, path, kwargs.get("headers") or {}, response.status_code))
+        return response
+
+    monkeypatch.setattr(client, "_send", record)
+    return sent
+
+
+def get_all(count: int, path: str, params: dict = None) -> list:
+    """Call get_json from ``count`` threads at once, returning answers or errors."""
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def get(index):
+        barrier.wait()
+        try:
+            results[index] = client.get_json(path, params=params)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_revalidates_with_etag(server, sent):
+    server.add_message("room0", "friend0", "hello")
+
+    first = client.get_json(MESSAGES)
+    second = client.get_json(MESSAGES)
+
+    assert "If-None-Match" not in sent[0][2]
+    assert sent[1][2]["If-None-Match"]
+    assert sent[1][3] == 304
+    assert second == first
+    # Callers may reorder what they get without touching the cached body
+    assert second is not first
+
+
+def test_changed_body_replaces_cached_one(server, sent):
+    client.get_json(MESSAGES)
+    server.add_message("room0", "friend0", "hello")
+
+    data = client.get_json(MESSAGES)
+
+    assert sent[1][3] == 200
+    assert [msg["content"] for msg in data["messages"]] == ["hello"]
+
+
+def test_least_recently_used_response_dropped(monkeypatch, server, sent):
+    monkeypatch.setattr(client_module, "RESPONSE_CACHE_SIZE", 2)
+    for skip in (0, 1, 0, 2):
+        client.get_json(MESSAGES, params={"skip": skip})
+    sent.clear()
+
+    client.get_json(MESSAGES, params={"skip": 0})
+    client.get_json(MESSAGES, params={"skip": 1})
+
+    assert "If-None-Match" in sent[0][2]
+    assert "If-None-Match" not in sent[1][2]
+
+
+def test_concurrent_reads_share_one_request(server):
+    server.latency = 0.3
+    server.add_message("room0", "friend0", "hello")
+    before = server.requests
+
+    results = get_all(5, MESSAGES)
+
+    assert server.requests - before == 1
+    assert all(result == results[0] for result in results)
+    assert len({id(result) for result in results}) == 5
+
+
+def test_error_reaches_every_shared_read(server):
+    server.latency = 0.3
+    before = server.requests
+
+    results = get_all(5, "/missing")
+
+    assert server.requests - before == 1
+    assert all(isinstance(result, requests.HTTPError) for result in results)
+    # Failures are not shared with later calls
+    with pytest.raises(requests.HTTPError):
+        client.get_json("/missing")
+    assert server.requests - before == 2
+
+
+def test_answers_shared_for_coalesce_window(monkeypatch, server):
+    monkeypatch.setattr(config.settings, "request_coalesce_window", 10)
+    client.get_json(MESSAGES)
+    before = server.requests
+
+    client.get_json(MESSAGES)
+
+    assert server.requests == before
+
+
+def test_write_ends_sharing(monkeypatch, server):
+    monkeypatch.setattr(config.settings, "request_coalesce_window", 10)
+    client.get_json(MESSAGES)
+
+    post_message("room0", USER_ID, "hello")
+    data = client.get_json(MESSAGES)
+
+    assert [msg["content"] for msg in data["messages"]] == ["hello"]
+
+
+def test_read_during_write_not_shared_after_it(monkeypatch, server):
+    monkeypatch.setattr(config.settings, "request_coalesce_window", 10)
+    send = client._send
+
+    def send_after_read(method, path, **kwargs):
+        if method == "POST":
+            # Answered before the server applies the write
+            assert client.get_json(MESSAGES)["messages"] == []
+        return send(method, path, **kwargs)
+
+    monkeypatch.setattr(client, "_send", send_after_read)
+    post_message("room0", USER_ID, "hello")
+    data = client.get_json(MESSAGES)
+
+    assert [msg["content"] for msg in data["messages"]] == ["hello"]
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(status, response=response)
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_rejected_before_handling_is_undelivered(status):
+    assert is_undelivered(http_error(status))
+
+
+@pytest.mark.parametrize("status", [400, 404, 500, 502, 504])
+def test_other_statuses_may_have_been_handled(status):
+    assert not is_undelivered(http_error(status))
+
+
+def test_failed_connection_is_undelivered():
+    refused = NewConnectionError(None, "Connection refused")
+
+    assert is_undelivered(requests.ConnectTimeout())
+    assert is_undelivered(requests.ConnectionError(MaxRetryError(None, "/", refused)))
+    assert is_undelivered(requests.ConnectionError(refused))
+
+
+def test_lost_connection_may_have_been_delivered():
+    assert not is_undelivered(requests.ReadTimeout())
+    assert not is_undelivered(requests.ConnectionError("Connection reset by peer"))
+    assert not is_undelivered(ValueError())
+
+
+def test_refused_request_is_undelivered(monkeypatch):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    monkeypatch.setattr(config.settings, "server_url", f"http://127.0.0.1:{port}")
+    monkeypatch.setattr(config.settings, "max_retries", 0)
+    client.close()
+
+    try:
+        with pytest.raises(requests.RequestException) as error:
+            client.post("/chat/messages", json={})
+    finally:
+        client.close()
+    assert is_undelivered(error.value)
+
+
+def test_timed_out_send_is_not_undelivered(monkeypatch, server):
+    monkeypatch.setattr(config.settings, "request_timeout", 0.1)
+    server.latency = 0.5
+
+    with pytest.raises(requests.RequestException) as error:
+        post_message("room0", USER_ID, "hello")
+    assert not is_undelivered(error.value)
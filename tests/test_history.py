@@ -0,0 +1,146 @@
+import csv
+import json
+
+import pytest
+
+from benchmarks.mock_server import USER_ID
+from src import history
+from src.config import config
+from src.history import export_history, import_history
+from src.store import MessageStore
+
+ROOM = "room0"
+
+
+class Interrupted(Exception):
+    pass
+
+
+def read_ids(path) -> list:
+    with open(path, newline="") as f:
+        if path.suffix == ".csv":
+            return [row["id"] for row in csv.DictReader(f)]
+        return [json.loads(line)["id"] for line in f]
+
+
+def add_messages(server, count: int, prefix: str) -> list:
+    return [server.add_message(ROOM, "friend0", f"{prefix} {i}") for i in range(count)]
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    monkeypatch.setattr(config.settings, "max_messages", 5)
+
+
+@pytest.mark.parametrize("name", ["export.jsonl", "export.csv"])
+def test_export_writes_newest_first(tmp_path, server, small_pages, name):
+    messages = add_messages(server, 12, "old")
+    path = tmp_path / name
+
+    written = export_history(ROOM, USER_ID, path, concurrency=2)
+
+    assert written == 12
+    assert read_ids(path) == [msg["id"] for msg in reversed(messages)]
+    assert not path.with_name(name + ".progress").exists()
+
+
+@pytest.mark.parametrize("name", ["export.jsonl", "export.csv"])
+def test_export_resumes_without_repeats_or_gaps(
+    monkeypatch, tmp_path, server, small_pages, name
+):
+    messages = add_messages(server, 23, "old")
+    path = tmp_path / name
+    saves = []
+    save_progress = history._save_progress
+
+    def interrupt_after_two_pages(progress_file, progress):
+        save_progress(progress_file, progress)
+        saves.append(progress)
+        if len(saves) == 2:
+            raise Interrupted
+
+    monkeypatch.setattr(history, "_save_progress", interrupt_after_two_pages)
+    with pytest.raises(Interrupted):
+        export_history(ROOM, USER_ID, path, concurrency=2)
+    monkeypatch.setattr(history, "_save_progress", save_progress)
+
+    # Shifts every page the export has left down by seven
+    add_messages(server, 7, "new")
+    export_history(ROOM, USER_ID, path, concurrency=2)
+
+    assert read_ids(path) == [msg["id"] for msg in reversed(messages)]
+
+
+def test_export_resume_drops_repeats_from_late_messages(
+    monkeypatch, tmp_path, server, small_pages
+):
+    messages = add_messages(server, 12, "old")
+    path = tmp_path / "export.jsonl"
+    save_progress = history._save_progress
+
+    def interrupt(progress_file, progress):
+        save_progress(progress_file, progress)
+        raise Interrupted
+
+    monkeypatch.setattr(history, "_save_progress", interrupt)
+    with pytest.raises(Interrupted):
+        export_history(ROOM, USER_ID, path, concurrency=1)
+    monkeypatch.setattr(history, "_save_progress", save_progress)
+
+    count_newer = history._count_newer
+
+    def message_after_counting(*args):
+        count = count_newer(*args)
+        # Not counted, so the first page resumed repeats the last one written
+        add_messages(server, 1, "late")
+        return count
+
+    monkeypatch.setattr(history, "_count_newer", message_after_counting)
+    export_history(ROOM, USER_ID, path, concurrency=1)
+
+    assert read_ids(path) == [msg["id"] for msg in reversed(messages)]
+
+
+def test_export_starts_over_without_resume(tmp_path, server, small_pages):
+    messages = add_messages(server, 7, "old")
+    path = tmp_path / "export.jsonl"
+    export_history(ROOM, USER_ID, path)
+
+    export_history(ROOM, USER_ID, path, resume=False)
+
+    assert read_ids(path) == [msg["id"] for msg in reversed(messages)]
+
+
+@pytest.mark.parametrize("name", ["export.jsonl", "export.csv"])
+def test_import_adds_exported_messages(tmp_path, server, name):
+    messages = add_messages(server, 3, "old")
+    path = tmp_path / name
+    export_history(ROOM, USER_ID, path)
+    store = MessageStore(tmp_path / "messages.db")
+
+    assert import_history(path, store) == 3
+    assert [msg["id"] for msg in store.recent(ROOM)] == [msg["id"] for msg in messages]
+
+
+def test_import_into_other_room(tmp_path):
+    path = tmp_path / "export.jsonl"
+    path.write_text(
+        json.dumps({"id": "1", "sender_id": "a", "sent_at": "t", "content": "x"})
+        + "\n"
+        + json.dumps({"id": "2", "sender_id": "a", "sent_at": "u", "chatroom_id": "r"})
+        + "\n"
+    )
+    store = MessageStore(tmp_path / "messages.db")
+
+    assert import_history(path, store, "other") == 2
+    assert [msg["id"] for msg in store.recent("other")] == ["1", "2"]
+
+
+def test_import_skips_messages_without_room(tmp_path):
+    path = tmp_path / "export.jsonl"
+    path.write_text(
+        json.dumps({"id": "1", "sender_id": "a", "sent_at": "t", "content": "x"}) + "\n"
+    )
+    store = MessageStore(tmp_path / "messages.db")
+
+    assert import_history(path, store) == 0
@@ -0,0 +1,70 @@
+import json
+
+from src import outbox as outbox_module
+from src.outbox import Outbox
+
+
+def test_messages_kept_across_restarts_in_order(tmp_path):
+    path = tmp_path / "outbox.json"
+    outbox = Outbox(path)
+    first = outbox.add("room0", "user", "one")
+    second = outbox.add("room1", "user", "two")
+
+    restarted = Outbox(path)
+
+    assert restarted.next() == first
+    assert restarted.pending_for() == [first, second]
+    assert restarted.pending_for("room1") == [second]
+    assert first["status"] == "pending"
+    assert first["id"] != second["id"]
+
+
+def test_removed_messages_stay_removed(tmp_path):
+    path = tmp_path / "outbox.json"
+    outbox = Outbox(path)
+    first = outbox.add("room0", "user", "one")
+    second = outbox.add("room0", "user", "two")
+
+    outbox.remove(first["id"])
+
+    assert outbox.next() == second
+    assert Outbox(path).pending_for() == [second]
+
+
+def test_file_replaced_in_one_step(monkeypatch, tmp_path):
+    path = tmp_path / "outbox.json"
+    outbox = Outbox(path)
+    first = outbox.add("room0", "user", "one")
+    replace = outbox_module.os.replace
+
+    def check_then_replace(source, target):
+        # Until the new file is complete the old one is left as it was
+        assert json.loads(path.read_text()) == [first]
+        replace(source, target)
+
+    monkeypatch.setattr(outbox_module.os, "replace", check_then_replace)
+    outbox.add("room0", "user", "two")
+
+    assert len(json.loads(path.read_text())) == 2
+    assert not path.with_name("outbox.json.tmp").exists()
+
+
+def test_failed_save_keeps_previous_file(monkeypatch, tmp_path):
+    path = tmp_path / "outbox.json"
+    outbox = Outbox(path)
+    first = outbox.add("room0", "user", "one")
+
+    def fail(source, target):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(outbox_module.os, "replace", fail)
+    outbox.add("room0", "user", "two")
+
+    assert json.loads(path.read_text()) == [first]
+
+
+def test_unreadable_file_loads_empty(tmp_path):
+    path = tmp_path / "outbox.json"
+    path.write_text('[{"id": ')
+
+    assert Outbox(path).next() is None
@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+from src.config import config
+from src.scheduler import PollScheduler
+
+
+def test_wake_ends_wait(monkeypatch):
+    monkeypatch.setattr(config.settings, "poll_jitter", 0)
+
+    async def run():
+        scheduler = PollScheduler(10)
+        asyncio.get_running_loop().call_later(0.05, scheduler.wake)
+        start = time.perf_counter()
+        await scheduler.wait()
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 1
+
+
+def test_resume_ends_one_wait_only(monkeypatch):
+    monkeypatch.setattr(config.settings, "poll_jitter", 0)
+
+    async def run():
+        scheduler = PollScheduler(0.05)
+        scheduler.pause()
+        waiting = asyncio.ensure_future(scheduler.wait())
+        # Past the delay, blocked until resumed
+        await asyncio.sleep(0.2)
+        assert not waiting.done()
+        scheduler.resume()
+        await asyncio.wait_for(waiting, 1)
+
+        start = time.perf_counter()
+        await scheduler.wait()
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) >= 0.04
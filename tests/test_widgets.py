@@ -0,0 +1,21 @@
+import pytest
+from textual.widgets import ListItem
+
+from src.widgets import list_item_id
+
+
+@pytest.mark.parametrize("key", ["é1", "a.b", "user@example.com", "好友", 42])
+def test_list_item_id_is_a_valid_id(key):
+    ListItem(id=list_item_id("friend", key))
+
+
+def test_list_item_id_keeps_keys_apart():
+    keys = ["a.b", "a_b", "a-b", "a b", "a_2eb", "ab"]
+
+    assert len({list_item_id("friend", key) for key in keys}) == len(keys)
+    assert list_item_id("search", "a-b", "c") != list_item_id("search", "a", "b-c")
+
+
+def test_list_item_id_is_stable():
+    assert list_item_id("friend", "abc123") == "friend-abc123"
+    assert list_item_id("friend", "é") == list_item_id("friend", "é")